@@ -5,11 +5,44 @@ const int ledPin = 13;    // the number of the LED pin
 
 // variables will change:
 int buttonState = 0;  // variable for reading the pushbutton status
-const unsigned int MAX_INPUT = 50;
+const unsigned int MAX_INPUT = 100;
 static char input_line [MAX_INPUT];
 static unsigned int input_pos = 0;
 bool buttonPressed = false;
 
+// points uploaded in bulk, visited one per button press
+const unsigned int QUEUE_SIZE = 64;
+const unsigned int MAX_CHUNK = 8;
+static float queue_x [QUEUE_SIZE];
+static float queue_y [QUEUE_SIZE];
+static unsigned int queue_head = 0;
+static unsigned int queue_count = 0;
+static unsigned long head_index = 0;  // index of the point at the head in the host list
+static bool press_pending = false;  // ENTER sent, the next point to arrive is visited right away
+
+// binary frames: sync, version, type, sequence, payload length, payload, CRC-16/CCITT of version..payload
+const byte FRAME_SYNC = 0xA5;
+const byte FRAME_VERSION = 2;  // point indices are u32
+const unsigned int FRAME_HEADER = 5;
+const unsigned int MAX_PAYLOAD = 64;
+const float FIXED_POINT_SCALE = 100.0;  // coordinates are int16 hundredths of a millimetre
+static byte frame[FRAME_HEADER + MAX_PAYLOAD + 2];
+static unsigned int frame_pos = 0;
+static byte tx_seq = 0;
+static bool binary_mode = false;  // set by a HELLO frame, replies are framed from then on
+
+enum FrameTypes {
+  FRAME_POINT = 0x01,
+  FRAME_BULK = 0x02,
+  FRAME_CHUNK = 0x03,
+  FRAME_HELLO = 0x04,
+  FRAME_ENTER = 0x10,
+  FRAME_CORRECTION = 0x11,
+  FRAME_ACK = 0x12,
+  FRAME_NAK = 0x13,
+  FRAME_NEXT = 0x14,
+};
+
 enum SerialMessages {
   NEXT_POINT = 'o',
 };
@@ -31,18 +64,232 @@ void process_data(const char* data) {
   Serial.println(data);
 }
 
+void move_to(float x, float y) {
+  press_pending = false;
+  Serial.println(x, 4);
+  Serial.println(y, 4);
+}
+
+// line protocol, the numbers of "PT(x,y)" are handled one by one
+void process_point_line(const char* line) {
+  char number[MAX_INPUT];
+  unsigned int pos = 0;
+  press_pending = false;
+
+  for(const char* c = line; ; c++) {
+    if(*c == ',' || *c == 0) {
+      number[pos] = 0;
+      process_data(number);
+      pos = 0;
+      if(*c == 0)
+        return;
+    } else if((*c >= '0' && *c <= '9') || *c == '.' || *c == '-') {
+      number[pos++] = *c;
+    }
+  }
+}
+
+uint16_t crc16_update(uint16_t crc, byte data) {
+  crc ^= (uint16_t)data << 8;
+  for(byte i = 0; i < 8; i++)
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+  return crc;
+}
+
+void send_frame(byte type, const byte* payload, byte length) {
+  byte header[FRAME_HEADER] = {FRAME_SYNC, FRAME_VERSION, type, tx_seq++, length};
+  uint16_t crc = 0xFFFF;
+  for(unsigned int i = 1; i < FRAME_HEADER; i++)
+    crc = crc16_update(crc, header[i]);
+  for(byte i = 0; i < length; i++)
+    crc = crc16_update(crc, payload[i]);
+
+  Serial.write(header, FRAME_HEADER);
+  Serial.write(payload, length);
+  Serial.write((byte)(crc & 0xFF));
+  Serial.write((byte)(crc >> 8));
+}
+
+void write_uint32(byte* data, unsigned long value) {
+  for(byte i = 0; i < 4; i++)
+    data[i] = (byte)(value >> (8 * i));
+}
+
+void reply(const char* message, byte type, unsigned long a, long b = -1) {
+  if(binary_mode) {
+    byte payload[8];
+    write_uint32(payload, a);
+    write_uint32(payload + 4, b);
+    send_frame(type, payload, b >= 0 ? 8 : 4);
+    return;
+  }
+
+  Serial.print(message);
+  Serial.print(' ');
+  Serial.print(a);
+  if(b >= 0) {
+    Serial.print(' ');
+    Serial.print(b);
+  }
+  Serial.print('\n');
+}
+
+// moves to the point at the head of the queue, the host only follows along
+void next_queued_point() {
+  move_to(queue_x[queue_head], queue_y[queue_head]);
+  reply("NEXT", FRAME_NEXT, head_index);
+  queue_head = (queue_head + 1) % QUEUE_SIZE;
+  queue_count--;
+  head_index++;
+}
+
+// queues the points of a chunk starting at `start` in the host list
+void queue_points(unsigned long start, const float* xs, const float* ys, unsigned int n) {
+  // a chunk sent again after a lost ACK is acknowledged without queueing it twice
+  unsigned long expected = head_index + queue_count;
+  if(start < expected) {
+    reply("ACK", FRAME_ACK, start, QUEUE_SIZE - queue_count);
+    return;
+  }
+  if(start > expected) {
+    // points sent over the line protocol in the meantime, only resync an empty queue
+    if(queue_count > 0) {
+      reply("NAK", FRAME_NAK, start, expected);
+      return;
+    }
+    head_index = start;
+  }
+  if(n > QUEUE_SIZE - queue_count) {
+    reply("NAK", FRAME_NAK, start, expected);
+    return;
+  }
+
+  for(unsigned int i = 0; i < n; i++) {
+    unsigned int slot = (queue_head + queue_count) % QUEUE_SIZE;
+    queue_x[slot] = xs[i];
+    queue_y[slot] = ys[i];
+    queue_count++;
+  }
+  reply("ACK", FRAME_ACK, start, QUEUE_SIZE - queue_count);
+
+  // the button was pressed while the queue was empty
+  if(press_pending)
+    next_queued_point();
+}
+
+void reset_queue() {
+  press_pending = false;
+  queue_head = 0;
+  queue_count = 0;
+  head_index = 0;
+  reply("BULK", FRAME_BULK, QUEUE_SIZE);
+}
+
+// "PC<start>:x,y;x,y*CS", CS is the hex XOR of every character before '*'
+void process_chunk(const char* line) {
+  const char* star = strchr(line, '*');
+  char* end;
+  unsigned long start = strtoul(line + 2, &end, 10);
+  if(star == NULL || *end != ':') {
+    return;
+  }
+
+  byte checksum = 0;
+  for(const char* c = line; c < star; c++)
+    checksum ^= *c;
+  if(checksum != strtoul(star + 1, NULL, 16)) {
+    reply("NAK", FRAME_NAK, start, head_index + queue_count);
+    return;
+  }
+
+  float xs[MAX_CHUNK], ys[MAX_CHUNK];
+  unsigned int n = 0;
+  const char* p = end + 1;
+  while(p < star && n < MAX_CHUNK) {
+    xs[n] = strtod(p, &end);
+    if(*end != ',') break;
+    ys[n] = strtod(end + 1, &end);
+    n++;
+    p = end + 1;
+  }
+  if(end != star) {
+    reply("NAK", FRAME_NAK, start, head_index + queue_count);
+    return;
+  }
+
+  queue_points(start, xs, ys, n);
+}
+
+int16_t read_int16(const byte* data) {
+  return (int16_t)(data[0] | ((uint16_t)data[1] << 8));
+}
+
+unsigned long read_uint32(const byte* data) {
+  return data[0] | ((unsigned long)data[1] << 8) | ((unsigned long)data[2] << 16) | ((unsigned long)data[3] << 24);
+}
+
+void process_frame(byte type, const byte* payload, byte length) {
+  if(type == FRAME_HELLO) {
+    binary_mode = true;
+    byte version = FRAME_VERSION;
+    send_frame(FRAME_HELLO, &version, 1);
+  } else if(type == FRAME_BULK) {
+    reset_queue();
+  } else if(type == FRAME_POINT && length == 4) {
+    move_to(read_int16(payload) / FIXED_POINT_SCALE, read_int16(payload + 2) / FIXED_POINT_SCALE);
+  } else if(type == FRAME_CHUNK && length >= 4 && (length - 4) % 4 == 0 && (length - 4) / 4 <= MAX_CHUNK) {
+    float xs[MAX_CHUNK], ys[MAX_CHUNK];
+    unsigned int n = (length - 4) / 4;
+    for(unsigned int i = 0; i < n; i++) {
+      xs[i] = read_int16(payload + 4 + 4 * i) / FIXED_POINT_SCALE;
+      ys[i] = read_int16(payload + 6 + 4 * i) / FIXED_POINT_SCALE;
+    }
+    queue_points(read_uint32(payload), xs, ys, n);
+  }
+}
+
+// collects a frame byte by byte, frames with a bad length or CRC are dropped
+void processFrameByte(const byte inByte) {
+  frame[frame_pos++] = inByte;
+  if(frame_pos < FRAME_HEADER)
+    return;
+
+  byte length = frame[4];
+  if(frame[1] != FRAME_VERSION || length > MAX_PAYLOAD) {
+    frame_pos = 0;
+    return;
+  }
+  if(frame_pos < FRAME_HEADER + length + 2)
+    return;
+
+  uint16_t crc = 0xFFFF;
+  for(unsigned int i = 1; i < FRAME_HEADER + length; i++)
+    crc = crc16_update(crc, frame[i]);
+  if(crc == (frame[FRAME_HEADER + length] | ((uint16_t)frame[FRAME_HEADER + length + 1] << 8)))
+    process_frame(frame[2], frame + FRAME_HEADER, length);
+  frame_pos = 0;
+}
+
+void process_line(const char* line) {
+  if(strncmp(line, "BULK", 4) == 0) {
+    reset_queue();
+  } else if(strncmp(line, "PC", 2) == 0) {
+    process_chunk(line);
+  } else {
+    process_point_line(line);
+  }
+}
+
 void processIncomingByte(const byte inByte){
-  if(inByte == '\n') {
+  if(frame_pos > 0 || (input_pos == 0 && inByte == FRAME_SYNC)) {
+    processFrameByte(inByte);
+  } else if(inByte == '\n') {
     input_line[input_pos] = 0;
-    process_data(input_line);
+    process_line(input_line);
     input_pos = 0;
-  } else if((inByte >= '0' && inByte <= '9') || inByte == '.' || inByte == '-') {
+  } else if(inByte >= ' ' && inByte <= '~') {
     if (input_pos < (MAX_INPUT - 1))
       input_line[input_pos++] = inByte;
-  } else if(inByte == ','){
-    input_line[input_pos] = 0;
-    process_data(input_line);
-    input_pos = 0;
   } else {
     return;
   }
@@ -61,12 +308,20 @@ void loop() {
     delay(10);
     buttonPressed = true;
 
-    String message = "ENTER\n";
-    Serial.write(message.begin(), message.length());
+    if(queue_count > 0) {
+      next_queued_point();
+    } else if(binary_mode) {
+      send_frame(FRAME_ENTER, NULL, 0);
+      press_pending = true;
+    } else {
+      String message = "ENTER\n";
+      Serial.write(message.begin(), message.length());
+      press_pending = true;
+    }
   } else if(!isButtonPressed() && buttonPressed) {
     // turn LED off:
     digitalWrite(ledPin, LOW);
     buttonPressed = false;
   }
 
-}
\ No newline at end of file
+}
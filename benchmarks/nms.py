@@ -0,0 +1,57 @@
+"""
+    Compares the grid NMS in detection/deep/utils.py against cv2.dnn.NMSBoxes
+    on synthetic plates of small, mostly disjoint colonies.
+
+    $ python -m benchmarks.nms
+"""
+import time
+import cv2
+import numpy as np
+
+from detection.deep.utils import nms
+
+
+def synthetic_colonies(num_box, rng, duplicates=0.2, density=1000 / 640**2):
+    side = np.sqrt(num_box / density)
+    num_unique = int(num_box * (1 - duplicates))
+
+    xy = rng.uniform(0, side, (num_unique, 2))
+    wh = rng.uniform(4, 16, (num_unique, 2))
+
+    # jittered copies of some colonies, the boxes nms has to suppress
+    src = rng.integers(0, num_unique, num_box - num_unique)
+    xy = np.concatenate((xy, xy[src] + rng.normal(0, 1, (len(src), 2))))
+    wh = np.concatenate((wh, wh[src] + rng.normal(0, 1, (len(src), 2))))
+
+    boxes = np.concatenate((xy, xy + wh), axis=1)
+    scores = rng.uniform(0.3, 1.0, num_box)
+    return boxes, scores
+
+
+def timeit(fn, repeat):
+    fn()
+    tik = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - tik) / repeat, result
+
+
+def main(sizes=(1000, 5000, 10000), iou_thres=0.45, repeat=5):
+    rng = np.random.default_rng(0)
+    print("%8s %14s %14s %8s %8s" %("boxes", "NMSBoxes (ms)", "grid nms (ms)", "speedup", "kept"))
+
+    for num_box in sizes:
+        boxes, scores = synthetic_colonies(num_box, rng)
+        xywh = np.concatenate((boxes[:, :2], boxes[:, 2:] - boxes[:, :2]), axis=1).tolist()
+        score_list = scores.tolist()
+
+        cv_time, cv_keep = timeit(lambda: cv2.dnn.NMSBoxes(xywh, score_list, 0.0, iou_thres), repeat)
+        grid_time, grid_keep = timeit(lambda: nms(boxes, scores, iou_thres), repeat)
+
+        print("%8d %14.2f %14.2f %7.1fx %4d/%d" %(
+            num_box, cv_time * 1000, grid_time * 1000, cv_time / grid_time, len(grid_keep), len(np.asarray(cv_keep).reshape(-1)),
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+    Drives SerialWrapper.setPoints against the positioner simulator in utils/simulator.py, without
+    the board, and reports the points per second and latencies of each protocol mode.
+
+    $ python -m benchmarks.serial_link
+"""
+import io
+import time
+import threading
+import contextlib
+import numpy as np
+
+from utils.serial import SerialWrapper
+from utils.simulator import PositionerSimulator
+from utils.entities import ColonyTable, ConversionFactor
+from utils.frame.geometry import BoxArray, Point
+
+
+MODES = {
+    "text line": dict(bulk=False, binary=False),
+    "text bulk": dict(bulk=True, binary=False),
+    "binary line": dict(bulk=False, binary=True),
+    "binary bulk": dict(bulk=True, binary=True),
+}
+
+
+def synthetic_plate(num_colonies, rng, resolution=640, dish_mm=90):
+    xy = rng.uniform(0, resolution - 16, (num_colonies, 2))
+    dets = np.concatenate((
+        xy,
+        xy + rng.uniform(4, 16, (num_colonies, 2)),
+        np.ones((num_colonies, 1)),
+        np.arange(num_colonies)[:, np.newaxis],
+    ), axis=1)
+    center = Point(resolution // 2, resolution // 2)
+    return ColonyTable(BoxArray.fromXYXY(dets), center, ConversionFactor(dish_mm / resolution))
+
+
+def run(colonies, mode, baud, buttonLatency, timeout):
+    simulator = PositionerSimulator(baud=baud, buttonLatency=buttonLatency)
+    wrapper = SerialWrapper(**MODES[mode])
+    thread = threading.Thread(target=wrapper.serialMain)
+
+    # the wrapper logs every message
+    with contextlib.redirect_stdout(io.StringIO()):
+        thread.start()
+        wrapper.open_serial(simulator.port)
+        # binary frames are negotiated when the port opens
+        time.sleep(wrapper.ackTimeout)
+
+        startTime = time.perf_counter()
+        wrapper.setPoints(colonies)
+        simulator.startOperator()
+
+        deadline = startTime + timeout
+        while len(simulator.moves) < len(colonies) and time.perf_counter() < deadline:
+            time.sleep(0.01)
+
+        wrapper.on_close()
+        thread.join()
+        simulator.close()
+
+    moves = simulator.moves[:len(colonies)]
+    visited = np.array([(x, y) for _, _, x, y in moves]).reshape(-1, 2)
+    latency = np.array([moved - pressed for pressed, moved, _, _ in moves])
+    elapsed = moves[-1][1] - startTime if moves else np.inf
+
+    return dict(
+        points=len(moves),
+        correct=len(moves) == len(colonies) and np.allclose(visited, colonies.offsets, atol=0.5 / 100),
+        rate=len(moves) / elapsed,
+        total=elapsed,
+        latency=latency.mean() if len(latency) else np.nan,
+        p95=np.percentile(latency, 95) if len(latency) else np.nan,
+    )
+
+
+def main(sizes=(10, 100, 1000, 10000), baud=115200, buttonLatency=0.0, timeout=120):
+    rng = np.random.default_rng(0)
+    print("%8s %12s %10s %10s %14s %14s %8s" %(
+        "points", "mode", "points/s", "total (s)", "latency (ms)", "p95 (ms)", "correct",
+    ))
+
+    for num_colonies in sizes:
+        colonies = synthetic_plate(num_colonies, rng)
+        for mode in MODES:
+            result = run(colonies, mode, baud, buttonLatency, timeout)
+            print("%8s %12s %10.1f %10.2f %14.2f %14.2f %8s" %(
+                "%d/%d" %(result["points"], num_colonies), mode, result["rate"], result["total"],
+                result["latency"] * 1000, result["p95"] * 1000, result["correct"],
+            ))
+
+
+if __name__ == "__main__":
+    main()
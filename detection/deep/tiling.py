@@ -0,0 +1,153 @@
+import cv2
+import numpy as np
+
+from argparse import Namespace
+
+from .utils import nms
+
+
+class TileScheduler:
+    """
+    Picks the tile size and overlap from the expected colony size range, in frame pixels.
+    The overlap holds the largest colony, so every colony is whole in at least one tile, and the tile
+    is scaled to the model input so the smallest colony reaches `min_detectable` pixels.
+    """
+    def __init__(self, model_size=640, min_colony=4, max_colony=40, min_detectable=8, max_upscale=2.0, edge_margin=2):
+        self.model_size = model_size
+        self.min_colony = min_colony
+        self.max_colony = max_colony
+        self.min_detectable = min_detectable
+        self.max_upscale = max_upscale
+        self.edge_margin = edge_margin
+
+    def schedule(self):
+        overlap = int(np.ceil(self.max_colony)) + 2 * self.edge_margin
+
+        tile = self.model_size * self.min_colony / self.min_detectable
+        tile = max(tile, self.model_size / self.max_upscale, 2 * overlap)
+
+        tile = int(np.ceil(tile))
+        return Namespace(tile=tile, overlap=overlap, scale=self.model_size / tile, edge_margin=self.edge_margin)
+
+
+def tile_grid(height, width, tile, overlap):
+    """
+    Origins (x, y) of `tile` sized tiles covering a `height` x `width` frame with at least `overlap`
+    pixels shared between neighbours. The fewest tiles that allow it are spread evenly, from the
+    frame origin to the border, so the spare overlap is shared instead of piling up on the last tile.
+    """
+    stride = tile - overlap
+
+    def starts(extent):
+        if extent <= tile:
+            return [0]
+        count = -(-(extent - tile) // stride) + 1
+        return np.round(np.linspace(0, extent - tile, count)).astype(int).tolist()
+
+    return [(x, y) for y in starts(height) for x in starts(width)]
+
+
+class TiledDetector:
+    """
+    Runs an ONNXModel over overlapping tiles of a full resolution frame (for example the dish region)
+    and merges the detections in frame coordinates. Tiles go through the model batch dimension, so
+    ONNX Runtime runs them in parallel on its intra-op threads.
+    """
+    def __init__(self, model, scheduler=None, iou_thres=0.45, latency_budget=None):
+        self.model = model
+        self.scheduler = scheduler if scheduler is not None else TileScheduler()
+        self.iou_thres = iou_thres
+        self.latency_budget = latency_budget
+
+    def _tiles(self, frame, plan):
+        h, w = frame.shape[:2]
+
+        # frames smaller than a tile are padded, boxes centred on the padding are dropped later
+        pad_h, pad_w = max(plan.tile - h, 0), max(plan.tile - w, 0)
+        if pad_h or pad_w:
+            frame = cv2.copyMakeBorder(frame, 0, pad_h, 0, pad_w, cv2.BORDER_CONSTANT, value=0)
+
+        origins = tile_grid(frame.shape[0], frame.shape[1], plan.tile, plan.overlap)
+        size = (self.scheduler.model_size, self.scheduler.model_size)
+        tiles = [
+            cv2.resize(frame[y:y + plan.tile, x:x + plan.tile], size, interpolation=cv2.INTER_LINEAR)
+            for x, y in origins
+        ]
+        return origins, tiles
+
+    def _seam_mask(self, boxes, origin, plan, height, width):
+        """Boxes touching a tile edge that is not the frame border, those colonies are whole in a neighbour."""
+        x, y = origin
+        margin = plan.edge_margin
+        x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+
+        seam = np.zeros(len(boxes), dtype=bool)
+        if x > 0:
+            seam |= x1 <= x + margin
+        if y > 0:
+            seam |= y1 <= y + margin
+        if x + plan.tile < width:
+            seam |= x2 >= x + plan.tile - margin
+        if y + plan.tile < height:
+            seam |= y2 >= y + plan.tile - margin
+        return seam
+
+    def predict(self, inputFrame, *args, roi=None, **kwargs):
+        """Raw outputs of every tile, with what `postprocess` needs to merge them."""
+        ox, oy = 0, 0
+        if roi is not None:
+            ox, oy, w, h = roi
+            inputFrame = inputFrame[oy:oy + h, ox:ox + w]
+
+        plan = self.scheduler.schedule()
+        origins, tiles = self._tiles(inputFrame, plan)
+
+        return Namespace(
+            outputs=self.model.predict_batch(tiles, latency_budget=self.latency_budget),
+            origins=origins,
+            plan=plan,
+            shape=inputFrame.shape[:2],
+            offset=(ox, oy),
+        )
+
+    def inference(self, inputFrame, score_thr, *args, roi=None, **kwargs):
+        """Same interface as ONNXModel.inference, returns a list with one (num_boxes, 6) array."""
+        return self.postprocess(self.predict(inputFrame, roi=roi), score_thr)
+
+    def postprocess(self, raw, score_thr):
+        """NMS of every tile, then the tiles are merged in frame coordinates."""
+        plan, origins = raw.plan, raw.origins
+        h, w = raw.shape
+        ox, oy = raw.offset
+        outputs = self.model.postprocess_batch(raw.outputs, score_thr)
+
+        merged = []
+        for origin, dets in zip(origins, outputs):
+            if not len(dets):
+                continue
+
+            # back to frame coordinates
+            dets = dets.copy()
+            dets[:, :4] /= plan.scale
+            dets[:, [0, 2]] += origin[0]
+            dets[:, [1, 3]] += origin[1]
+
+            merged.append(dets[~self._seam_mask(dets, origin, plan, max(h, plan.tile), max(w, plan.tile))])
+
+        if not merged:
+            return [np.zeros((0, 6))]
+
+        dets = np.concatenate(merged)
+        centers = (dets[:, :2] + dets[:, 2:4]) / 2
+        dets = dets[(centers[:, 0] < w) & (centers[:, 1] < h)]
+        dets[:, [0, 2]] = np.clip(dets[:, [0, 2]], 0, w)
+        dets[:, [1, 3]] = np.clip(dets[:, [1, 3]], 0, h)
+
+        # duplicates of colonies inside the overlaps, nms per class as in non_max_suppression
+        class_offset = dets[:, 5:6] * (max(h, w) + 1)
+        keep = nms(dets[:, :4] + class_offset, dets[:, 4], self.iou_thres)
+
+        dets = dets[keep]
+        dets[:, [0, 2]] += ox
+        dets[:, [1, 3]] += oy
+        return [dets]
@@ -25,11 +25,160 @@ def xywh2xyxy(x):
     return y
 
 
+def letterbox(image, new_shape, color=(114, 114, 114), out=None):
+    '''Resizes `image` to fit `new_shape` (h, w) keeping its aspect ratio and pads the rest with `color`.
+    Returns the padded image, the scale and the (left, top) padding, boxes map back as (box - pad) / scale.
+    With `out`, a preallocated array of the padded shape, the result is written into it and nothing is allocated.'''
+    h, w = image.shape[:2]
+    scale = min(new_shape[0] / h, new_shape[1] / w)
+    resized_w, resized_h = int(round(w * scale)), int(round(h * scale))
+
+    pad_w, pad_h = new_shape[1] - resized_w, new_shape[0] - resized_h
+    left, top = pad_w // 2, pad_h // 2
+
+    if out is not None:
+        view = out[top:top + resized_h, left:left + resized_w]
+        if (resized_w, resized_h) != (w, h):
+            cv2.resize(image, (resized_w, resized_h), dst=view, interpolation=cv2.INTER_LINEAR)
+        else:
+            np.copyto(view, image)
+
+        # only the padding bands are filled
+        out[:top] = color
+        out[top + resized_h:] = color
+        out[top:top + resized_h, :left] = color
+        out[top:top + resized_h, left + resized_w:] = color
+        return out, scale, (left, top)
+
+    if (resized_w, resized_h) != (w, h):
+        image = cv2.resize(image, (resized_w, resized_h), interpolation=cv2.INTER_LINEAR)
+    image = cv2.copyMakeBorder(image, top, pad_h - top, left, pad_w - left, cv2.BORDER_CONSTANT, value=color)
+    return image, scale, (left, top)
+
+
+def box_area(boxes):
+    '''Areas of boxes with shape [n, 4] in [x1, y1, x2, y2] format.'''
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def pairwise_iou(boxes_a, boxes_b):
+    '''IoU between matching rows of two [n, 4] arrays in [x1, y1, x2, y2] format.'''
+    w = np.clip(np.minimum(boxes_a[:, 2], boxes_b[:, 2]) - np.maximum(boxes_a[:, 0], boxes_b[:, 0]), 0, None)
+    h = np.clip(np.minimum(boxes_a[:, 3], boxes_b[:, 3]) - np.maximum(boxes_a[:, 1], boxes_b[:, 1]), 0, None)
+    inter = w * h
+    union = box_area(boxes_a) + box_area(boxes_b) - inter
+    return np.divide(inter, union, out=np.zeros_like(inter, dtype=float), where=union > 0)
+
+
+def _expand_ranges(lo, hi):
+    '''Returns (owner, value) for every value in the half-open ranges [lo[i], hi[i]).'''
+    counts = np.clip(hi - lo, 0, None)
+    owner = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, lo[owner] + offsets
+
+
+def candidate_pairs(boxes, cell_size=None):
+    '''Pairs (i, j), i < j, of boxes that may overlap, found with a uniform grid.
+    Boxes are binned by their top-left corner in cells at least as large as the box, so two boxes can
+    only overlap when their cells are neighbours. Boxes larger than the cell are paired with every box.
+    Args:
+        boxes: (array), with shape [n, 4] in [x1, y1, x2, y2] format.
+        cell_size: (float or None), grid cell side, by default twice the 95th percentile of box sides.
+
+    Returns:
+         two index arrays with the first and second box of each pair.
+    '''
+    num_box = boxes.shape[0]
+    extent = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+    if cell_size is None:
+        cell_size = 2 * np.percentile(extent, 95) if num_box else 1
+    cell_size = max(float(cell_size), 1e-6)
+
+    large = extent > cell_size
+    small_idx, large_idx = np.nonzero(~large)[0], np.nonzero(large)[0]
+
+    # grid pairs between small boxes, half of the 3x3 neighbourhood to visit each pair once
+    cells = np.floor(boxes[small_idx, :2] / cell_size).astype(np.int64)
+    cells -= cells.min(axis=0) - 1 if len(cells) else 0
+    stride = int(cells[:, 1].max()) + 2 if len(cells) else 1
+    keys = cells[:, 0] * stride + cells[:, 1]
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    positions = np.arange(len(order))
+
+    firsts, seconds = [], []
+    for dx, dy in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        target = sorted_keys + dx * stride + dy
+        hi = np.searchsorted(sorted_keys, target, side='right')
+        lo = positions + 1 if (dx, dy) == (0, 0) else np.searchsorted(sorted_keys, target, side='left')
+        owner, other = _expand_ranges(lo, hi)
+        firsts.append(order[owner])
+        seconds.append(order[other])
+
+    first, second = small_idx[np.concatenate(firsts)], small_idx[np.concatenate(seconds)]
+
+    # large boxes are compared against everything else
+    if len(large_idx):
+        owner, other = np.repeat(large_idx, num_box), np.tile(np.arange(num_box), len(large_idx))
+        valid = ~large[other] | (other > owner)
+        first, second = np.concatenate((first, owner[valid])), np.concatenate((second, other[valid]))
+
+    return first, second
+
+
+def nms(boxes, scores, iou_thres, cell_size=None):
+    '''Greedy NMS where each box is only compared with its grid neighbours.
+    Gives the same result as the classic greedy NMS: a box is kept when no kept box with a higher score
+    overlaps it above `iou_thres`. The conflicts are resolved in vectorized rounds, one per level of
+    the longest suppression chain, which stays short for mostly disjoint colonies.
+    Args:
+        boxes: (array), with shape [n, 4] in [x1, y1, x2, y2] format.
+        scores: (array), with shape [n].
+        iou_thres: (float) iou threshold.
+        cell_size: (float or None), grid cell side, see `candidate_pairs`.
+
+    Returns:
+         indices of the kept boxes sorted by decreasing score.
+    '''
+    num_box = boxes.shape[0]
+    order = np.argsort(-scores, kind='stable')
+    if num_box < 2:
+        return order
+
+    rank = np.empty(num_box, dtype=np.int64)
+    rank[order] = np.arange(num_box)
+
+    first, second = candidate_pairs(boxes, cell_size)
+    overlap = pairwise_iou(boxes[first], boxes[second]) > iou_thres
+    first, second = first[overlap], second[overlap]
+
+    # edges go from the higher ranked box to the one it may suppress
+    swap = rank[first] > rank[second]
+    parent = np.where(swap, second, first)
+    child = np.where(swap, first, second)
+
+    # 1 kept, -1 suppressed, 0 undecided
+    status = np.where(np.bincount(child, minlength=num_box) == 0, 1, 0)
+    while True:
+        suppressed = np.bincount(child[status[parent] == 1], minlength=num_box) > 0
+        status[(status == 0) & suppressed] = -1
+
+        pending = np.bincount(child[status[parent] == 0], minlength=num_box)
+        decided = (status == 0) & (pending == 0)
+        if not decided.any():
+            break
+        status[decided] = 1
+
+    return order[status[order] == 1]
+
+
 def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, multi_label=False, max_det=300):
     """Runs Non-Maximum Suppression (NMS) on inference results.
     This code is borrowed from: https://github.com/ultralytics/yolov5/blob/47233e1698b89fc437a4fb9463c815e9171be955/utils/general.py#L775
     Args:
-        prediction: (tensor), with shape [N, 5 + num_classes], N is the number of bboxes.
+        prediction: (array), with shape [B, N, 5 + num_classes], N is the number of bboxes.
         conf_thres: (float) confidence threshold.
         iou_thres: (float) iou threshold.
         classes: (None or list[int]), if a list is provided, nms only keep the classes you provide.
@@ -38,23 +187,23 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
         max_det:(int), max number of output bboxes.
 
     Returns:
-         list of detections, echo item is one tensor with shape (num_boxes, 6), 6 is for [xyxy, conf, cls].
+         list of detections, echo item is one array with shape (num_boxes, 6), 6 is for [xyxy, conf, cls].
     """
 
     num_classes = prediction.shape[2] - 5  # number of classes
-    pred_candidates = np.logical_and(prediction[..., 4] > conf_thres, np.max(prediction[..., 5:], axis=-1)[0] > conf_thres)  # candidates
+    pred_candidates = np.logical_and(prediction[..., 4] > conf_thres, np.max(prediction[..., 5:], axis=-1) > conf_thres)  # candidates
     # Check the parameters.
     assert 0 <= conf_thres <= 1, f'conf_thresh must be in 0.0 to 1.0, however {conf_thres} is provided.'
     assert 0 <= iou_thres <= 1, f'iou_thres must be in 0.0 to 1.0, however {iou_thres} is provided.'
 
     # Function settings.
     max_wh = 4096  # maximum box width and height
-    max_nms = 30000  # maximum number of boxes put into torchvision.ops.nms()
+    max_nms = 30000  # maximum number of boxes put into nms()
     time_limit = 10.0  # quit the function when nms cost time exceed the limit time.
     multi_label &= num_classes > 1  # multiple labels per box
 
     tik = time.time()
-    output = [np.zeros((0, prediction.shape[2]))] * prediction.shape[0]
+    output = [np.zeros((0, 6))] * prediction.shape[0]
     for img_idx, x in enumerate(prediction):  # image index, image inference
         x = x[pred_candidates[img_idx]]  # confidence
 
@@ -70,8 +219,8 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
 
         # Detections matrix's shape is  (n,6), each row represents (xyxy, conf, cls)
         if multi_label:
-            box_idx, class_idx = (x[:, 5:] > conf_thres).nonzero(as_tuple=False).T
-            x = np.cat((box[box_idx], x[box_idx, class_idx + 5, None], class_idx[:, None].float()), 1)
+            box_idx, class_idx = np.nonzero(x[:, 5:] > conf_thres)
+            x = np.concatenate((box[box_idx], x[box_idx, class_idx + 5, None], class_idx[:, None].astype(float)), axis=1)
         else:  # Only keep the class with highest scores.
             class_probs = x[:, 5:]
             class_idx = np.argmax(class_probs, axis=1, keepdims=True)
@@ -87,12 +236,12 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
         if not num_box:  # no boxes kept.
             continue
         elif num_box > max_nms:  # excess max boxes' number.
-            x = x[x[:, 4].argsort(descending=True)[:max_nms]]  # sort by confidence
+            x = x[np.argsort(-x[:, 4], kind='stable')[:max_nms]]  # sort by confidence
 
         # Batched NMS
         class_offset = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
         boxes, scores = x[:, :4] + class_offset, x[:, 4]  # boxes (offset by class), scores
-        keep_box_idx = cv2.dnn.NMSBoxes(bboxes=boxes, scores=scores, score_threshold=conf_thres, nms_threshold=iou_thres)
+        keep_box_idx = nms(boxes, scores, iou_thres)
 
         if len(keep_box_idx) == 0:
             continue
@@ -105,4 +254,4 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
             print(f'WARNING: NMS cost time exceed the limited {time_limit}s.')
             break  # time limit exceeded
 
-    return np.stack(output)
+    return output
@@ -1,23 +1,277 @@
+import os
+import time
+import hashlib
+import platform
 import numpy as np
 import onnxruntime as ort
 
-from .utils import non_max_suppression
+from pathlib import Path
+from argparse import Namespace
+
+from .utils import non_max_suppression, letterbox
+
+
+class ExecutionProfile:
+    """
+    ONNX Runtime session settings. Thread counts of 0 leave the choice to ONNX Runtime,
+    `cache_dir` set to None disables the on-disk cache of optimized graphs.
+    """
+    OPTIMIZATION_LEVELS = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    EXECUTION_MODES = {
+        "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+        "parallel": ort.ExecutionMode.ORT_PARALLEL,
+    }
+
+    def __init__(
+        self,
+        intra_op_threads=0,
+        inter_op_threads=0,
+        optimization_level="all",
+        execution_mode="sequential",
+        cache_dir=os.path.join(Path.home(), ".CameraPositioner", "onnx-cache"),
+    ):
+        if optimization_level not in self.OPTIMIZATION_LEVELS:
+            raise ValueError("Unknown optimization level %s, expected one of %s" %(optimization_level, list(self.OPTIMIZATION_LEVELS)))
+        if execution_mode not in self.EXECUTION_MODES:
+            raise ValueError("Unknown execution mode %s, expected one of %s" %(execution_mode, list(self.EXECUTION_MODES)))
+
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.optimization_level = optimization_level
+        self.execution_mode = execution_mode
+        self.cache_dir = cache_dir
+
+    def session_options(self):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.graph_optimization_level = self.OPTIMIZATION_LEVELS[self.optimization_level]
+        options.execution_mode = self.EXECUTION_MODES[self.execution_mode]
+        return options
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
 class ONNXModel:
-    def __init__(self, model_path="./models/bacteria-l.onnx", custom_export=True):
-        self.ort_sess = ort.InferenceSession(model_path)
+    def __init__(self, model_path="./models/bacteria-l.onnx", custom_export=True, profile=None, warmup=True, max_batch=16):
+        self.profile = profile if profile is not None else ExecutionProfile()
+        self.ort_sess = self._create_session(model_path)
         self._custom_export = custom_export
 
-    def inference(self, inputFrmae, score_thr, *args, **kwargs):
-        samples = np.array(inputFrmae)[np.newaxis,:].transpose(0,3,1,2).astype(np.float32) / 255
-        if self._custom_export:
-            outputs = self.ort_sess.run(None, {'input': samples})
-            outputs = np.array(outputs[0])
-            # NMS
-            outputs = non_max_suppression(outputs, score_thr, 0.45, max_det=10000)
-        else:
-            outputs = self.ort_sess.run(None, {'images': samples})
-            print(outputs)
+        self._input_name = self.ort_sess.get_inputs()[0].name
+        self._output_name = self.ort_sess.get_outputs()[0].name
+        self._bindings = {}
+        self.max_bindings = 8
+        self._letterboxed = {}
+        self._batch_sizes = {}
+
+        # exports with a fixed batch dimension only run that batch size
+        batch_dim = self.ort_sess.get_inputs()[0].shape[0]
+        self.static_batch = batch_dim if isinstance(batch_dim, int) else None
+        self.max_batch = self.static_batch if self.static_batch is not None else max_batch
+
+        if warmup:
+            self.warmup()
+
+    def _cached_model_path(self, model_path):
+        # optimized graphs may hold hardware specific kernels, the runtime and machine are part of the key
+        key = "%s-%s-%s" %(file_hash(model_path), ort.__version__, platform.machine())
+        digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+        name = "%s-%s-%s.onnx" %(Path(model_path).stem, digest, self.profile.optimization_level)
+        return os.path.join(self.profile.cache_dir, name)
+
+    def _create_session(self, model_path):
+        options = self.profile.session_options()
+        if self.profile.cache_dir is None or self.profile.optimization_level == "disable":
+            return ort.InferenceSession(model_path, sess_options=options)
+
+        cached_path = self._cached_model_path(model_path)
+        if os.path.exists(cached_path):
+            # the graph is already optimized, skip the optimization passes on load
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            print("Loading optimized model from %s" %(cached_path))
+            return ort.InferenceSession(cached_path, sess_options=options)
+
+        os.makedirs(self.profile.cache_dir, exist_ok=True)
+        partial_path = cached_path + ".partial"
+        options.optimized_model_filepath = partial_path
+        session = ort.InferenceSession(model_path, sess_options=options)
+        if os.path.exists(partial_path):
+            os.replace(partial_path, cached_path)
+            print("Optimized model cached at %s" %(cached_path))
+
+        return session
+
+    def _bind(self, batch_size, frame_shape):
+        """
+        Preallocates the NCHW input for `batch_size` frames of `frame_shape` (H, W, C) and binds it, with a
+        reused output buffer, through IO binding. The output shape is taken from a first run, exports with a
+        fixed input size have a fixed output shape.
+        """
+        h, w, c = frame_shape
+        staged = Namespace(input=np.zeros((batch_size, c, h, w), dtype=np.float32))
+        staged.binding = self.ort_sess.io_binding()
+        staged.binding.bind_cpu_input(self._input_name, staged.input)
+
+        staged.binding.bind_output(self._output_name, 'cpu')
+        self.ort_sess.run_with_iobinding(staged.binding)
+        output_shape = staged.binding.get_outputs()[0].shape()
+
+        staged.output = np.empty(output_shape, dtype=np.float32)
+        staged.binding.bind_output(self._output_name, 'cpu', 0, np.float32, list(output_shape), staged.output.ctypes.data)
+
+        return staged
+
+    def _run(self, frames, batch_size=None):
+        """
+        Runs the model on a sequence of frames, normalized and transposed into the bound input in a single
+        pass each. A static batch is padded to `batch_size`, the returned array is reused by the next call.
+        """
+        batch_size = len(frames) if batch_size is None else batch_size
+        key = (batch_size,) + tuple(frames[0].shape)
+        if key not in self._bindings:
+            # region of interest sizes vary with dynamic models, keep the buffers of the latest few
+            if len(self._bindings) >= self.max_bindings:
+                self._bindings.pop(next(iter(self._bindings)))
+            self._bindings[key] = self._bind(batch_size, frames[0].shape)
+        staged = self._bindings[key]
+
+        for i, frame in enumerate(frames):
+            np.divide(frame.transpose(2, 0, 1), np.float32(255), out=staged.input[i])
+        self.ort_sess.run_with_iobinding(staged.binding)
+
+        return staged.output[:len(frames)]
+
+    def batch_size_for(self, frame_shape, latency_budget=None):
+        """
+        Largest power of two batch, up to `max_batch`, whose run on frames of `frame_shape` fits in
+        `latency_budget` seconds. Measured once per shape and budget.
+        """
+        if self.static_batch is not None:
+            return self.static_batch
+        if latency_budget is None:
+            return self.max_batch
+
+        key = (tuple(frame_shape), latency_budget)
+        if key not in self._batch_sizes:
+            best, batch_size = 1, 1
+            blank = np.zeros(frame_shape, dtype=np.uint8)
+            while batch_size <= self.max_batch:
+                frames = [blank] * batch_size
+                self._run(frames)
+                startTime = time.time()
+                self._run(frames)
+                if time.time() - startTime > latency_budget:
+                    break
+                best, batch_size = batch_size, batch_size * 2
+
+            # only keep the buffers of the sizes in use
+            self._bindings = {k: v for k, v in self._bindings.items() if k[0] in (1, best)}
+            self._batch_sizes[key] = best
+            print("Batch size %d for %s frames (budget %.3f s)." %(best, frame_shape, latency_budget))
+
+        return self._batch_sizes[key]
+
+    def warmup(self):
+        """Runs one inference on a blank input so the first real frame does not pay the setup cost."""
+        model_input = self.ort_sess.get_inputs()[0]
+        # dynamic dimensions fall back to a single 640x640 image
+        defaults = [1, 3, 640, 640]
+        _, c, h, w = [dim if isinstance(dim, int) else defaults[i] for i, dim in enumerate(model_input.shape)]
+
+        startTime = time.time()
+        self._run([np.zeros((h, w, c), dtype=np.uint8)], self.static_batch)
+        print("Model warm-up took %.3f s." %(time.time() - startTime))
+
+    def _roi_shape(self, roi):
+        """Letterbox target for a region of interest, the model input when static, otherwise the region rounded up to the stride."""
+        h, w = self.ort_sess.get_inputs()[0].shape[2:]
+        if isinstance(h, int) and isinstance(w, int):
+            return h, w
+
+        stride = 64
+        return -(-roi[3] // stride) * stride, -(-roi[2] // stride) * stride
+
+    def predict(self, inputFrmae, *args, roi=None, **kwargs):
+        """
+        Raw model output for a frame, before NMS. `roi` (x, y, w, h) restricts the model to that crop,
+        letterboxed to the model input. The result can be kept to re-run `postprocess` when only the
+        score threshold changes.
+        """
+        transform = None
+        if roi is not None:
+            x, y, w, h = roi
+            # the crop is letterboxed into a buffer kept per target shape, like the bound input
+            shape = tuple(self._roi_shape(roi)) + inputFrmae.shape[2:]
+            if shape not in self._letterboxed:
+                if len(self._letterboxed) >= self.max_bindings:
+                    self._letterboxed.pop(next(iter(self._letterboxed)))
+                self._letterboxed[shape] = np.empty(shape, dtype=np.uint8)
+
+            inputFrmae, scale, pad = letterbox(inputFrmae[y:y + h, x:x + w], shape[:2], out=self._letterboxed[shape])
+            transform = (x, y, scale, pad)
+
+        # the bound output is overwritten by the next run, the raw result is kept for `postprocess`
+        return Namespace(outputs=self._run([inputFrmae], self.static_batch).copy(), transform=transform)
+
+    def postprocess(self, raw, score_thr):
+        """NMS over a `predict` result, boxes are returned in frame coordinates."""
+        if not self._custom_export:
+            print(raw.outputs)
             exit(0)
 
-        return outputs
\ No newline at end of file
+        # NMS
+        outputs = non_max_suppression(raw.outputs, score_thr, 0.45, max_det=10000)
+
+        if raw.transform is not None:
+            x, y, scale, pad = raw.transform
+            for dets in outputs:
+                dets[:, [0, 2]] = (dets[:, [0, 2]] - pad[0]) / scale + x
+                dets[:, [1, 3]] = (dets[:, [1, 3]] - pad[1]) / scale + y
+
+        return outputs
+
+    def inference(self, inputFrmae, score_thr, *args, roi=None, **kwargs):
+        """Detections for a frame, boxes are returned in frame coordinates with or without `roi`."""
+        return self.postprocess(self.predict(inputFrmae, roi=roi), score_thr)
+
+    def predict_batch(self, frames, latency_budget=None):
+        """
+        Raw outputs for a list of equally sized frames or tiles, run in as few session runs as the batch
+        size allows. Returns an array with one entry per frame along the batch dimension.
+        """
+        batch_size = self.batch_size_for(frames[0].shape, latency_budget)
+        if self.static_batch is None:
+            batch_size = min(batch_size, len(frames))
+
+        outputs = []
+        for start in range(0, len(frames), batch_size):
+            # the last chunk is padded, so buffers are only allocated for `batch_size`
+            chunk = frames[start:start + batch_size]
+            outputs.append(self._run(chunk, batch_size).copy())
+
+        return np.concatenate(outputs)
+
+    def postprocess_batch(self, raw, score_thr):
+        return non_max_suppression(raw, score_thr, 0.45, max_det=10000)
+
+    def inference_batch(self, frames, score_thr, latency_budget=None):
+        """
+        Runs a list of equally sized frames or tiles in as few session runs as the batch size allows.
+        Returns one (num_boxes, 6) array per frame, as `non_max_suppression` does for a batch.
+        """
+        if len(frames) == 0:
+            return []
+
+        return self.postprocess_batch(self.predict_batch(frames, latency_budget), score_thr)
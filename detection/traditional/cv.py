@@ -1,29 +1,81 @@
 import tkinter as tk
 import cv2
+import numpy as np
 
 class CVDetector:
-    def __init__(self):
+    def __init__(self, min_area=0, max_area=200, canny_low=100, canny_high=200):
         self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5,5))
-    
-    def inference(self, inputFrame, *args, **kwargs):
+        self.min_area = min_area
+        self.max_area = max_area
+        self.canny_low = canny_low
+        self.canny_high = canny_high
+
+    def components(self, inputFrame, roi=None, mask=None):
+        """
+        Labels the colony mask in a single pass, matching the contours of cv2.findContours with RETR_TREE:
+        the foreground components (8-connected) and the holes inside them (4-connected background).
+        With a region of interest (x, y, w, h) only that crop is processed, and components whose box centre
+        falls outside `mask` (frame sized, non zero inside) are dropped. Clearing the pixels instead would
+        cut new fragments and holes along the mask border. Coordinates are in frame pixels.
+        Returns the (N, 4) boxes as (x1, y1, x2, y2), the (N,) bounding box areas and the (N, 2) centroids.
+        """
+        ox, oy = 0, 0
+        if roi is not None:
+            ox, oy, w, h = roi
+            inputFrame = inputFrame[oy:oy + h, ox:ox + w]
+            mask = mask[oy:oy + h, ox:ox + w] if mask is not None else None
+
         gray = cv2.cvtColor(inputFrame, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 100, 200)
+        edges = cv2.Canny(gray, self.canny_low, self.canny_high)
         thresh = cv2.threshold(edges, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
 
         opening = 255 - cv2.morphologyEx(thresh, cv2.MORPH_OPEN, self.kernel, iterations=2)
 
-        contours, hier = cv2.findContours(opening, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        _, _, stats, centroids = cv2.connectedComponentsWithStats(opening, connectivity=8)
+        _, holeLabels, holeStats, holeCentroids = cv2.connectedComponentsWithStats(
+            (opening == 0).astype(np.uint8), connectivity=4,
+        )
+
+        # background regions touching the border are not holes
+        border = np.zeros(len(holeStats), dtype=bool)
+        border[holeLabels[[0, -1], :]] = True
+        border[holeLabels[:, [0, -1]]] = True
+        border[0] = True
+
+        # a hole contour runs over the foreground pixels around it
+        holeStats = holeStats[~border, :4] + np.array([-1, -1, 2, 2])
+
+        # label 0 is the background
+        stats = np.concatenate((stats[1:, :4], holeStats))
+        centroids = np.concatenate((centroids[1:], holeCentroids[~border]))
+        x, y = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+        w, h = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]
+
+        if mask is not None:
+            inside = mask[y + h // 2, x + w // 2] != 0
+            x, y, w, h, centroids = x[inside], y[inside], w[inside], h[inside], centroids[inside]
+
+        boxes = np.stack((x + ox, y + oy, x + ox + w, y + oy + h), axis=1)
+        return boxes, w * h, centroids + (ox, oy)
+
+    def predict(self, inputFrame, *args, roi=None, mask=None, **kwargs):
+        """
+        Returns the detections as a (1, N, 6) float array of (x1, y1, x2, y2, score, idx), batched like ONNXModel.
+        `roi` and `mask` restrict the search to the dish, see `components`.
+        """
+        boxes, areas, _ = self.components(inputFrame, roi, mask)
+        boxes = boxes[(self.min_area < areas) & (areas < self.max_area)]
+
+        valid = np.empty((len(boxes), 6), dtype=np.float64)
+        valid[:, :4] = boxes
+        valid[:, 4] = 1.0
+        valid[:, 5] = np.arange(len(boxes))
 
-        valid = []
-        i = 0
+        return valid[np.newaxis]
 
-        # draw a bounding box around each contour
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            area = w * h
-            #TODO: PARAMETRIZE MAX AREA
-            if 0 < area < 200:
-                valid.append([(x, y, x+w, y+h, 1.0, i)])
-                i += 1
+    def postprocess(self, raw, *args, **kwargs):
+        """Every component scores 1.0, the score threshold does not change the detections."""
+        return raw
 
-        return valid
\ No newline at end of file
+    def inference(self, inputFrame, *args, roi=None, mask=None, **kwargs):
+        return self.postprocess(self.predict(inputFrame, roi=roi, mask=mask))
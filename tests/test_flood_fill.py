@@ -0,0 +1,47 @@
+import os
+import glob
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.entities import PetriDish, floodFillBFS, floodFillLabels
+
+
+IMAGES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "images", "*")))
+
+
+def segment(path) -> np.ndarray:
+    dish = PetriDish(88)
+    dish.segmentDish(cv2.imread(path))
+    return dish._segmentation
+
+
+@pytest.mark.parametrize("path", IMAGES, ids=os.path.basename)
+def test_engines_match_on_dish(path):
+    seg = segment(path)
+    seed = (seg.shape[0] // 2, seg.shape[1] // 2)
+
+    assert np.array_equal(floodFillBFS(seed, seg), floodFillLabels(seed, seg))
+
+
+@pytest.mark.parametrize("path", IMAGES, ids=os.path.basename)
+def test_engines_match_on_background_seed(path):
+    seg = segment(path)
+    rows, cols = np.nonzero(seg == 0)
+    seed = (int(rows[0]), int(cols[0]))
+
+    mask = floodFillLabels(seed, seg)
+    assert mask[seed] == 1
+    assert np.array_equal(floodFillBFS(seed, seg), mask)
+
+
+def test_background_seed_floods_foreground_neighbours():
+    seg = np.zeros((5, 5))
+    seg[0, :] = 1
+    seg[3:, 3:] = 1
+    seed = (1, 2)
+
+    mask = floodFillLabels(seed, seg)
+    assert np.array_equal(floodFillBFS(seed, seg), mask)
+    assert mask[0].all() and mask[seed] == 1 and not mask[3:, 3:].any()
@@ -1,4 +1,5 @@
 import cv2
+import threading
 
 def list_ports():
     """
@@ -24,4 +25,96 @@ def list_ports():
                 print("Port %s for camera ( %s x %s) is present but does not reads." %(dev_port,h,w))
                 available_ports.append(dev_port)
         dev_port +=1
-    return available_ports, working_ports, non_working_ports
\ No newline at end of file
+    return available_ports, working_ports, non_working_ports
+
+class CameraStream:
+    """
+    Captures frames on a dedicated thread and only keeps the newest one, stale frames are dropped.
+    The camera format (FOURCC, resolution and driver buffer size) is applied every time a device is opened.
+    """
+    def __init__(self, index=0, fourcc=None, resolution=None, bufferSize=1):
+        self.fourcc = fourcc
+        self.resolution = resolution
+        self.bufferSize = bufferSize
+
+        self._cap = None
+        self._capLock = threading.Lock()
+        self._frameCondition = threading.Condition()
+        self._frame = None
+        self._frameId = 0
+        self._consumedId = 0
+        self.dropped = 0
+
+        self._stopEvent = threading.Event()
+        self.open(index)
+
+        self._thread = threading.Thread(target=self._captureMain, daemon=True)
+        self._thread.start()
+
+    def _configure(self, cap):
+        if not cap.isOpened():
+            print("Camera could not be opened.")
+            return
+
+        if self.fourcc is not None:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+        if self.resolution is not None:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.resolution[0])
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.resolution[1])
+        if self.bufferSize is not None:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, self.bufferSize)
+
+        print("Camera format: %s (%d x %d)" %(
+            self.describeFourcc(cap.get(cv2.CAP_PROP_FOURCC)),
+            cap.get(cv2.CAP_PROP_FRAME_WIDTH),
+            cap.get(cv2.CAP_PROP_FRAME_HEIGHT),
+        ))
+
+    @staticmethod
+    def describeFourcc(value):
+        value = int(value)
+        return "".join([chr((value >> 8 * i) & 0xFF) for i in range(4)])
+
+    def open(self, index):
+        with self._capLock:
+            if self._cap is not None:
+                self._cap.release()
+
+            self._cap = cv2.VideoCapture(index)
+            self._configure(self._cap)
+
+    def _captureMain(self):
+        while not self._stopEvent.is_set():
+            with self._capLock:
+                ret, frame = self._cap.read() if self._cap is not None else (False, None)
+
+            if not ret:
+                self._stopEvent.wait(0.01)
+                continue
+
+            with self._frameCondition:
+                if self._frameId > self._consumedId:
+                    self.dropped += 1
+                self._frame = frame
+                self._frameId += 1
+                self._frameCondition.notify_all()
+
+    def read(self, lastId=0, timeout=None):
+        """
+        Waits for a frame newer than `lastId` and returns (frameId, frame), or (lastId, None) on timeout.
+        """
+        with self._frameCondition:
+            if not self._frameCondition.wait_for(lambda: self._frameId > lastId, timeout):
+                return lastId, None
+
+            self._consumedId = self._frameId
+            return self._frameId, self._frame
+
+    def release(self):
+        self._stopEvent.set()
+        self._thread.join()
+
+        with self._capLock:
+            if self._cap is not None:
+                self._cap.release()
+                self._cap = None
@@ -228,5 +228,19 @@ class SerialController(Controls):
     def placeControls(self):
         tk.Label(self.controls_frame, text=self.label_name + ":").pack()
 
-        serial_dropdown = tk.OptionMenu(self.root, self.serial_var, *self.options, command=self.on_serial_change)
-        serial_dropdown.pack(side="left")
\ No newline at end of file
+        self.serial_dropdown = tk.OptionMenu(self.root, self.serial_var, *self.options, command=self.on_serial_change)
+        self.serial_dropdown.pack(side="left")
+
+    def setOptions(self, options, selected=None):
+        """Replaces the dropdown entries, keeps the current choice while it is still listed and clears it otherwise."""
+        self.options = list(options) or [""]
+
+        menu = self.serial_dropdown["menu"]
+        menu.delete(0, "end")
+        for option in self.options:
+            menu.add_command(label=option, command=tk._setit(self.serial_var, option, self.on_serial_change))
+
+        if selected is not None:
+            self.serial_var.set(selected)
+        elif self.serial_var.get() not in self.options:
+            self.serial_var.set("")
\ No newline at end of file
@@ -4,10 +4,73 @@ import numpy as np
 
 from collections import deque
 
-from utils.frame.geometry import Circle, Rectangle, Point
+from utils.frame.geometry import Circle, Rectangle, Point, BoxArray, CircleArray
 from utils.frame.drawings import Color
 
 
+def floodFillBFS(seed, seg) -> np.ndarray:
+    """
+        Reference flood fill, walks the region pixel by pixel in Python.
+        `seed` is given as (row, column).
+    """
+    newMat = np.zeros_like(seg)
+    N, M = len(seg), len(seg[0])
+    directions = [(-1,0), (0,-1), (1,0), (0,1)]
+    queue = deque([seed])
+    seen = set([seed])
+
+    valid = lambda a, b: 0 <= a < N and 0 <= b < M and seg[a][b]
+
+    while queue:
+        x, y = queue.popleft()
+
+        newMat[x][y] = 1
+
+        for d in directions:
+            xx, yy = x + d[0], y + d[1]
+
+            if (xx, yy) in seen: continue
+
+            if valid(xx, yy):
+                queue.append((xx, yy))
+
+            seen.add((xx, yy))
+
+    return newMat
+
+
+def floodFillLabels(seed, seg) -> np.ndarray:
+    """
+        Label map flood fill, same output as `floodFillBFS`.
+        `seed` is given as (row, column).
+    """
+    newMat = np.zeros_like(seg)
+    row, col = seed
+    N, M = seg.shape[:2]
+
+    _, labels = cv2.connectedComponents((seg != 0).astype(np.uint8), connectivity=4)
+
+    # the seed is always kept, on the background the fill starts from its foreground neighbours
+    if seg[row, col]:
+        starts = [(row, col)]
+    else:
+        starts = [(row + dr, col + dc) for dr, dc in ((-1, 0), (0, -1), (1, 0), (0, 1))]
+        starts = [(r, c) for r, c in starts if 0 <= r < N and 0 <= c < M and seg[r, c]]
+
+    regions = [labels[r, c] for r, c in starts]
+    if regions:
+        newMat[np.isin(labels, regions)] = 1
+    newMat[row, col] = 1
+
+    return newMat
+
+
+FLOOD_FILL_METHODS = {
+    "labels": floodFillLabels,
+    "bfs": floodFillBFS,
+}
+
+
 class ConversionFactor:
     def __init__(self, value=0):
         self._factor = 0
@@ -27,10 +90,12 @@ class ConversionFactor:
 class PetriDish():
     def __init__(self, diameter: float):
         self._segmentation = None
+        self._threshold: float = 0
 
         self._pixelCentroid: Point = Point(0, 0)
         self._pixelRadius: float = 0
         self._pixelArea: float = 0
+        self._boundingBox = None
 
         self._diameter: float = diameter
         self._conversionFactor: float = ConversionFactor()
@@ -68,9 +133,19 @@ class PetriDish():
     
     def setDishDiameter(self, diameter: float) -> None:
         self._diameter = diameter
+        self._updateConversionFactor()
+
+    def getBoundingBox(self):
+        """
+            Dish bounding box as (x, y, w, h), None before the first segmentation.
+        """
+        return self._boundingBox
+
+    def getThreshold(self) -> float:
+        return self._threshold
 
     def _updateConversionFactor(self) -> None:
-        if self._diameter == 0:
+        if self._diameter == 0 or self._pixelRadius == 0:
             return
         
         self._conversionFactor.update(self._diameter / (2 * self._pixelRadius))
@@ -92,41 +167,24 @@ class PetriDish():
         )
 
         self.findCentroid()
+        self._boundingBox = cv2.boundingRect(self._segmentation.astype(np.uint8))
 
         self._pixelArea = self._segmentation.sum()
         self._pixelRadius = np.sqrt(self._pixelArea / np.pi)
 
         self._updateConversionFactor()
 
-    def _clearSegmentation(self, centroid, seg):
-        newMat = np.zeros_like(seg)
-        N, M = len(seg), len(seg[0])
-        directions = [(-1,0), (0,-1), (1,0), (0,1)]
-        queue = deque([centroid])
-        seen = set([centroid])
-
-        valid = lambda a, b: 0 <= a < N and 0 <= b < M and seg[a][b]
-
-        while queue:
-            x, y = queue.popleft()
-            
-            newMat[x][y] = 1
-
-            for d in directions:
-                xx, yy = x + d[0], y + d[1]
+    def _clearSegmentation(self, centroid, seg, method="labels"):
+        """
+            Keeps only the region of `seg` connected (4-neighbourhood) to `centroid`.
+            `method` selects the label map engine ("labels") or the pure Python
+            BFS ("bfs"), kept as a reference implementation for verification.
+        """
+        return FLOOD_FILL_METHODS[method](centroid, seg)
 
-                if (xx, yy) in seen: continue
-
-                if valid(xx, yy):
-                    queue.append((xx, yy))
-
-                seen.add((xx, yy))
-
-        return newMat
-    
     def segmentDish(self, image) -> np.ndarray:
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+        self._threshold, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
 
         # Morph open using elliptical shaped kernel
         kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3,3))
@@ -143,6 +201,73 @@ class PetriDish():
         return self.center is not None
 
 
+class DishTracker():
+    """
+        Keeps the last dish segmentation and only re-segments the dish when the
+        frame drifts away from it. Drift is measured on a downsampled frame,
+        binarized with the last Otsu threshold, over a ring around the dish border.
+    """
+    def __init__(self, dish: PetriDish, tolerance: float = 0.05, scale: int = 8, ringWidth: int = 2):
+        self._dish: PetriDish = dish
+        self._tolerance: float = tolerance
+        self._scale: int = scale
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
+        self._ringWidth: int = ringWidth
+
+        self._reference: np.ndarray = None
+        self._ring: np.ndarray = None
+        self._estimate = None
+        self.drift: float = 1.0
+
+    def invalidate(self) -> None:
+        self._reference = None
+
+    def _binarize(self, image) -> np.ndarray:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape
+        small = cv2.resize(gray, (max(w // self._scale, 1), max(h // self._scale, 1)), interpolation=cv2.INTER_AREA)
+
+        return small > self._dish.getThreshold()
+
+    def _updateReference(self, image) -> None:
+        self._reference = self._binarize(image)
+
+        h, w = self._reference.shape
+        mask = cv2.resize(self._dish._segmentation.astype(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST)
+        outer = cv2.dilate(mask, self._kernel, iterations=self._ringWidth)
+        inner = cv2.erode(mask, self._kernel, iterations=self._ringWidth)
+        self._ring = (outer - inner) != 0
+
+    def measureDrift(self, image) -> float:
+        """
+            Fraction of ring pixels whose binarized value changed since the last segmentation.
+        """
+        if self._reference is None or self._ring is None or not self._ring.any():
+            return 1.0
+
+        current = self._binarize(image)
+        if current.shape != self._reference.shape:
+            return 1.0
+
+        return float(np.count_nonzero(current[self._ring] != self._reference[self._ring])) / np.count_nonzero(self._ring)
+
+    def update(self, image, estimate) -> bool:
+        """
+            Updates the dish parameters from `image`, returns True if the dish was re-segmented.
+        """
+        self.drift = self.measureDrift(image) if estimate == self._estimate else 1.0
+
+        if self.drift <= self._tolerance:
+            return False
+
+        self._dish.segmentDish(image)
+        self._dish.findParameters(estimate)
+        self._estimate = estimate
+        self._updateReference(image)
+
+        return True
+
+
 class Colony():
     def __init__(self, detection: Rectangle, dishPixelCenter: Point, conversionFactor: ConversionFactor):
         self._conversionFactor: ConversionFactor = conversionFactor
@@ -182,3 +307,62 @@ class Colony():
         '''
         return self._limits.area * self._conversionFactor
 
+
+class ColonyTable():
+    """
+        The colonies of one detection as columns, the counterpart of a list of Colony.
+        Offsets from the dish centre are converted to mm for all colonies at once, with the
+        conversion factor at the time the table is built. Indexing returns a Colony.
+    """
+    def __init__(self, detections: BoxArray, dishPixelCenter: Point, conversionFactor: ConversionFactor):
+        # snapshot, the dish factor is shared and changes with the diameter slider
+        self._conversionFactor: ConversionFactor = ConversionFactor(conversionFactor.linear)
+        self._detections: BoxArray = detections
+        self._coordinateZero: Point = dishPixelCenter
+
+        self._limits: CircleArray = CircleArray.fromBoxes(detections)
+        self.pixelOffsets: np.ndarray = self._limits.center.toArray()
+        self.offsets: np.ndarray = self._conversionFactor * (self.pixelOffsets - (dishPixelCenter.x, dishPixelCenter.y))
+
+    @classmethod
+    def empty(cls):
+        return cls(BoxArray.empty(), Point(0, 0), ConversionFactor())
+
+    def __len__(self):
+        return len(self._detections)
+
+    def __getitem__(self, index) -> Colony:
+        return Colony(self._detections[index], self._coordinateZero, self._conversionFactor)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def take(self, order) -> "ColonyTable":
+        """The colonies at the indices of `order`, in that order."""
+        return ColonyTable(self._detections[np.asarray(order)], self._coordinateZero, self._conversionFactor)
+
+    @property
+    def idx(self) -> np.ndarray:
+        return self._detections.idx
+
+    @property
+    def radii(self) -> np.ndarray:
+        return self._limits.r
+
+    def getConversionFactor(self) -> ConversionFactor:
+        return self._conversionFactor
+
+    def getPixelAreas(self) -> np.ndarray:
+        return self._limits.area
+
+    def getAreas(self) -> np.ndarray:
+        return self._limits.area * self._conversionFactor.linear
+
+    def encode(self, fmt="(%.4f,%.4f)"):
+        """
+            Serial messages of every colony, formatted as Colony offsets were, in a single format call.
+        """
+        if len(self) == 0:
+            return []
+
+        return ((fmt + "\n") * len(self) %(tuple(self.offsets.ravel().tolist()))).splitlines()
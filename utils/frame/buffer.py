@@ -0,0 +1,104 @@
+import time
+import threading
+
+import numpy as np
+
+
+class FrameAccumulator:
+    """
+        Fixed depth ring buffer of frames with a running sum, the temporal
+        average is computed in O(pixels) without allocating per call.
+        Every access holds `lock`, the time it is held is kept in `lockStats`.
+    """
+    def __init__(self, depth: int = 10, lock: threading.Lock = None):
+        if depth < 1:
+            raise ValueError("depth must be at least 1, got %d" %(depth))
+
+        self.depth: int = depth
+        self.lock: threading.Lock = lock if lock is not None else threading.Lock()
+
+        self._slab: np.ndarray = None
+        self._sum: np.ndarray = None
+        self._mean: np.ndarray = None
+        self._idx: int = 0
+        self.frameCount: int = 0
+
+        self.lockStats = {"last": 0.0, "max": 0.0, "total": 0.0, "count": 0}
+
+    def _recordLock(self, startTime: float) -> None:
+        held = time.perf_counter() - startTime
+        self.lockStats["last"] = held
+        self.lockStats["max"] = max(self.lockStats["max"], held)
+        self.lockStats["total"] += held
+        self.lockStats["count"] += 1
+
+    def _reset(self, frame: np.ndarray) -> None:
+        # a new buffer starts filled with the first frame, as the previous deque did
+        self._slab = np.empty((self.depth,) + frame.shape, dtype=np.uint8)
+        self._slab[:] = frame
+        self._sum = frame.astype(np.uint32) * self.depth
+        self._mean = np.empty(frame.shape, dtype=np.uint8)
+        self._idx = 0
+
+    def isEmpty(self) -> bool:
+        return self._slab is None
+
+    def push(self, frame: np.ndarray) -> None:
+        with self.lock:
+            startTime = time.perf_counter()
+            if self._slab is None or self._slab.shape[1:] != frame.shape:
+                self._reset(frame)
+            else:
+                self._sum -= self._slab[self._idx]
+                self._sum += frame
+                self._slab[self._idx] = frame
+                self._idx = (self._idx + 1) % self.depth
+            self.frameCount += 1
+            self._recordLock(startTime)
+
+    def mean(self, out: np.ndarray = None) -> np.ndarray:
+        """
+            Writes the truncated average into `out`, or into an internal buffer
+            reused between calls when `out` is not given.
+        """
+        with self.lock:
+            startTime = time.perf_counter()
+            if self._sum is None:
+                self._recordLock(startTime)
+                return None
+
+            out = self._mean if out is None else out
+            np.floor_divide(self._sum, self.depth, out=out, casting="unsafe")
+            self._recordLock(startTime)
+
+        return out
+
+    def meanLockTime(self) -> float:
+        if self.lockStats["count"] == 0:
+            return 0.0
+
+        return self.lockStats["total"] / self.lockStats["count"]
+
+
+class DoubleBuffer:
+    """
+        Two result slots, the writer fills `back` and publishes it with `swap()`.
+        Readers take `front` without locking, a slot is only rewritten after the
+        next swap, so readers copy whatever they keep for longer than one cycle.
+    """
+    def __init__(self, factory):
+        self._buffers = [factory(), factory()]
+        self._front: int = 0
+        self.version: int = 0
+
+    @property
+    def front(self):
+        return self._buffers[self._front]
+
+    @property
+    def back(self):
+        return self._buffers[1 - self._front]
+
+    def swap(self) -> None:
+        self._front = 1 - self._front
+        self.version += 1
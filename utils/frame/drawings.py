@@ -1,8 +1,11 @@
-from typing import List, Tuple
+from typing import List
+
+import numpy as np
 
 from .geometry.rectangle import Rectangle
 from .geometry.boundingbox import BoundingBox
 from .geometry.circle import Circle
+from .geometry.arrays import BoxArray
 
 
 class Color:
@@ -13,45 +16,58 @@ class Color:
     CYAN = (255,192,0)
 
 
+def validRegion(shape, mask: np.ndarray = None, removable_area: List[Rectangle] = ()) -> np.ndarray:
+    """
+        Boolean raster of the pixels a box centre may fall on: inside `mask` when given,
+        and outside every removable area (borders included, as Rectangle.contains).
+    """
+    valid = np.ones(shape[:2], dtype=bool) if mask is None else mask != 0
+    for area in removable_area:
+        valid[max(area.y, 0):max(area.yy + 1, 0), max(area.x, 0):max(area.xx + 1, 0)] = False
+
+    return valid
+
+
+def filterDetections(outputs, frame_shape, score_thr, valid: np.ndarray = None) -> BoxArray:
+    """
+        Clips the (N, 6) detections of every batch entry to the frame, keeps those scoring above
+        `score_thr` whose centre is set in `valid` (see `validRegion`), all in one pass.
+    """
+    height, width = frame_shape[:2]
+    dets = np.concatenate([np.asarray(output, dtype=np.float64).reshape(-1, 6) for output in outputs]) \
+        if len(outputs) else np.zeros((0, 6))
+
+    dets = dets[dets[:, 4] > score_thr]
+    dets[:, [0, 2]] = np.clip(dets[:, [0, 2]], 0, width)
+    dets[:, [1, 3]] = np.clip(dets[:, [1, 3]], 0, height)
+
+    boxes = BoxArray.fromXYXY(dets)
+    if valid is not None and len(boxes):
+        center = boxes.center
+        boxes = boxes[valid[np.minimum(center.y, height - 1), np.minimum(center.x, width - 1)]]
+
+    return boxes
+
+
 def getBboxes(outputs, frame_resolution, score_thr, removable_area:List[Rectangle]):
-    rects:List[Tuple[int]] = []
-    boxes:List[Rectangle] = []
-
-    for output in outputs:
-        for box in output:
-            print(box)
-            if len(box) == 0: continue
-
-            box = [
-                min(box[0], frame_resolution[1]),
-                min(box[1], frame_resolution[0]),
-                min(box[2], frame_resolution[1]),
-                min(box[3], frame_resolution[0]),
-                box[4],
-                box[5],
-            ]   # transform from tupleto lix, avoiding modifying the underlying data
-
-            x1, y1, x2, y2, score, index = box
-            if score > score_thr:
-                x, y, h, w = int(x1), int(y1), int(abs(x1-x2)), int(abs(y1-y2))
-                bbox = BoundingBox(x, y, h, w, index)
-                remove_box = False
-                if len(removable_area) > 0:
-                    for area in removable_area:
-                        remove_box |= area.contains(bbox.center)
-
-                if not remove_box:
-                    boxes.append(bbox)
-                    rects.append((x, y, x+w, y+h))
-    
-    if len(boxes) == 0:
-        print("No detections.")
-
-    print(boxes, rects)
-
-    return rects, boxes
+    """
+        Boxes above `score_thr` whose centre is outside the removable areas, as (rects, boxes).
+        `frame_resolution` is (height, width).
+    """
+    detections = filterDetections(
+        outputs, 
+        frame_resolution, 
+        score_thr, 
+        validRegion(frame_resolution, removable_area=removable_area),
+    )
+
+    return [tuple(rect) for rect in detections.toXYXY().tolist()], list(detections)
 
 
 def drawBoxes(boxes:List[BoundingBox], frame):
+    if isinstance(boxes, BoxArray):
+        boxes.draw(frame, color=Color.GREEN)
+        return
+
     for bbox in boxes:
         bbox.draw(frame, color=Color.GREEN)
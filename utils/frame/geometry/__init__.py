@@ -1,4 +1,6 @@
 from .circle import Circle
 from .boundingbox import BoundingBox
 from .rectangle import Rectangle
-from .point import Point
\ No newline at end of file
+from .point import Point
+from .arrays import PointArray, BoxArray, CircleArray
+from .grid import SpatialGrid
@@ -0,0 +1,192 @@
+import cv2
+import numpy as np
+
+from .point import Point
+from .circle import Circle
+from .boundingbox import BoundingBox
+
+
+class PointArray():
+    """
+        Struct of arrays counterpart of Point, `x` and `y` are NumPy columns.
+        Indexing with an int returns a Point, with a slice or mask a PointArray.
+    """
+    __slots__ = ("x", "y")
+
+    def __init__(self, x, y):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+
+    @classmethod
+    def fromPoints(cls, points):
+        xy = np.array([tuple(p) for p in points]).reshape(-1, 2)
+        return cls(xy[:, 0], xy[:, 1])
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if np.isscalar(index):
+            return Point(self.x[index].item(), self.y[index].item())
+
+        return PointArray(self.x[index], self.y[index])
+
+    def __iter__(self):
+        return (Point(x, y) for x, y in zip(self.x.tolist(), self.y.tolist()))
+
+    def __add__(self, val):
+        if isinstance(val, (Point, PointArray)):
+            return PointArray(self.x + val.x, self.y + val.y)
+
+        raise ValueError("err")
+
+    def __sub__(self, val):
+        if isinstance(val, (Point, PointArray)):
+            return PointArray(self.x - val.x, self.y - val.y)
+
+        raise ValueError("err")
+
+    def __mul__(self, val):
+        if isinstance(val, (float, int, np.ndarray)):
+            return PointArray(self.x * val, self.y * val)
+
+        raise ValueError("err")
+
+    def abs(self) -> np.ndarray:
+        return np.hypot(self.x, self.y)
+
+    def distance(self, p) -> np.ndarray:
+        """Distance of every point to `p`, a Point or a PointArray of the same length."""
+        return np.hypot(self.x - p.x, self.y - p.y)
+
+    def toArray(self) -> np.ndarray:
+        return np.stack((self.x, self.y), axis=1)
+
+
+class BoxArray():
+    """
+        Struct of arrays counterpart of BoundingBox: integer `x`, `y`, `w`, `h` columns with the
+        detection `idx` and `score`. Indexing with an int returns a BoundingBox, with a slice or mask
+        a BoxArray, so box objects are only built for the boxes that are actually read.
+    """
+    __slots__ = ("x", "y", "w", "h", "idx", "score")
+
+    def __init__(self, x, y, w, h, idx=None, score=None):
+        self.x = np.asarray(x, dtype=np.int32)
+        self.y = np.asarray(y, dtype=np.int32)
+        self.w = np.asarray(w, dtype=np.int32)
+        self.h = np.asarray(h, dtype=np.int32)
+        self.idx = np.arange(len(self.x), dtype=np.int32) if idx is None else np.asarray(idx, dtype=np.int32)
+        self.score = np.ones(len(self.x), dtype=np.float32) if score is None else np.asarray(score, dtype=np.float32)
+
+    @classmethod
+    def empty(cls):
+        return cls(*np.zeros((4, 0)))
+
+    @classmethod
+    def fromXYXY(cls, dets: np.ndarray):
+        """From a (N, 6) array of x1, y1, x2, y2, score, idx, the size is truncated as BoundingBox did."""
+        dets = np.asarray(dets, dtype=np.float64).reshape(-1, 6)
+        w, h = dets[:, 2] - dets[:, 0], dets[:, 3] - dets[:, 1]
+        return cls(dets[:, 0], dets[:, 1], w, h, dets[:, 5], dets[:, 4])
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if np.isscalar(index):
+            return BoundingBox(
+                self.x[index].item(),
+                self.y[index].item(),
+                self.w[index].item(),
+                self.h[index].item(),
+                self.idx[index].item(),
+            )
+
+        return BoxArray(self.x[index], self.y[index], self.w[index], self.h[index], self.idx[index], self.score[index])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def xx(self) -> np.ndarray:
+        return self.x + self.w
+
+    @property
+    def yy(self) -> np.ndarray:
+        return self.y + self.h
+
+    @property
+    def center(self) -> PointArray:
+        return PointArray(self.x + self.w // 2, self.y + self.h // 2)
+
+    @property
+    def area(self) -> np.ndarray:
+        return self.w * self.h
+
+    def contains(self, p) -> np.ndarray:
+        """
+            Borders included, as Rectangle.contains. A Point gives one flag per box,
+            a PointArray a (boxes, points) matrix.
+        """
+        if isinstance(p, PointArray):
+            px, py = p.x[np.newaxis], p.y[np.newaxis]
+            return (self.x[:, np.newaxis] <= px) & (px <= self.xx[:, np.newaxis]) \
+                & (self.y[:, np.newaxis] <= py) & (py <= self.yy[:, np.newaxis])
+
+        return (self.x <= p.x) & (p.x <= self.xx) & (self.y <= p.y) & (p.y <= self.yy)
+
+    def distance(self, p) -> np.ndarray:
+        """Distance of every box centre to `p`."""
+        return self.center.distance(p)
+
+    def toXYXY(self) -> np.ndarray:
+        return np.stack((self.x, self.y, self.xx, self.yy), axis=1)
+
+    def draw(self, frame, color=(0, 255, 0)):
+        """Same drawing as BoundingBox.draw, straight from the columns."""
+        for x, y, xx, yy, idx in zip(self.x.tolist(), self.y.tolist(), self.xx.tolist(), self.yy.tolist(), self.idx.tolist()):
+            cv2.rectangle(frame, (x, y), (xx, yy), color, 2)
+            cv2.putText(frame, "%d"%(idx), (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2, cv2.LINE_AA)
+
+        return frame
+
+
+class CircleArray():
+    """Struct of arrays counterpart of Circle."""
+    __slots__ = ("x", "y", "r")
+
+    def __init__(self, x, y, r):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.r = np.asarray(r)
+
+    @classmethod
+    def fromBoxes(cls, boxes: BoxArray):
+        """Circles around the box centres with the box diagonal as radius, as Colony builds them."""
+        center = boxes.center
+        return cls(center.x, center.y, np.hypot(boxes.w, boxes.h))
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if np.isscalar(index):
+            return Circle(self.x[index].item(), self.y[index].item(), self.r[index].item())
+
+        return CircleArray(self.x[index], self.y[index], self.r[index])
+
+    @property
+    def center(self) -> PointArray:
+        return PointArray(self.x, self.y)
+
+    @property
+    def area(self) -> np.ndarray:
+        return np.pi * self.r ** 2
+
+    def distance(self, p) -> np.ndarray:
+        """Distance of every centre to `p`."""
+        return self.center.distance(p)
+
+    def contains(self, p) -> np.ndarray:
+        return self.distance(p) <= self.r
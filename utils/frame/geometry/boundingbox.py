@@ -3,6 +3,8 @@ import cv2
 from .rectangle import Rectangle
 
 class BoundingBox(Rectangle):
+    __slots__ = ()
+
     def draw(self, frame, color=(0, 255, 0)):
         p1, p2 = list(self.limits[0]), list(self.limits[1])
         frame = cv2.rectangle(frame, p1, p2, color, 2)
@@ -4,6 +4,8 @@ import numpy as np
 from .point import Point
 
 class Circle():
+    __slots__ = ("x", "y", "r", "_center", "_area")
+
     def __init__(self, x, y, r):
         self.x = x
         self.y = y
@@ -0,0 +1,125 @@
+import math
+
+from collections import defaultdict
+
+from .point import Point
+
+
+class SpatialGrid():
+    """
+        Uniform grid index of boxes, given as (x, y, xx, yy). Each box is registered in every cell it
+        overlaps for containment queries, and in the cell of its centre for nearest queries, so both
+        only visit the cells around the query point.
+    """
+    def __init__(self, cellSize: int = 32):
+        self.cellSize = cellSize
+        self._boxes = {}
+        self._cells = defaultdict(set)
+        self._centers = defaultdict(set)
+        self._extent = None
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def __contains__(self, key):
+        return key in self._boxes
+
+    def _cell(self, x, y):
+        return int(x // self.cellSize), int(y // self.cellSize)
+
+    def _cellsOf(self, x, y, xx, yy):
+        (c0, r0), (c1, r1) = self._cell(x, y), self._cell(xx, yy)
+        return [(c, r) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)]
+
+    @staticmethod
+    def _ring(cx, cy, ring):
+        """Cells at Chebyshev distance `ring` from (cx, cy)."""
+        if ring == 0:
+            return [(cx, cy)]
+
+        cells = [(c, r) for r in (cy - ring, cy + ring) for c in range(cx - ring, cx + ring + 1)]
+        cells += [(c, r) for c in (cx - ring, cx + ring) for r in range(cy - ring + 1, cy + ring)]
+        return cells
+
+    def _center(self, key):
+        x, y, xx, yy = self._boxes[key]
+        return (x + xx) / 2, (y + yy) / 2
+
+    def insert(self, key, x, y, xx, yy):
+        if key in self._boxes:
+            self.remove(key)
+
+        x, xx = min(x, xx), max(x, xx)
+        y, yy = min(y, yy), max(y, yy)
+        self._boxes[key] = (x, y, xx, yy)
+        for cell in self._cellsOf(x, y, xx, yy):
+            self._cells[cell].add(key)
+        self._centers[self._cell(*self._center(key))].add(key)
+        self._extent = None
+
+    def remove(self, key):
+        for cell in self._cellsOf(*self._boxes[key]):
+            self._cells[cell].discard(key)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+        center = self._cell(*self._center(key))
+        self._centers[center].discard(key)
+        if not self._centers[center]:
+            del self._centers[center]
+
+        del self._boxes[key]
+        self._extent = None
+
+    def clear(self):
+        self._boxes.clear()
+        self._cells.clear()
+        self._centers.clear()
+        self._extent = None
+
+    def contains(self, p: Point) -> list:
+        """Keys of the boxes containing `p`, borders included as Rectangle.contains."""
+        keys = self._cells.get(self._cell(p.x, p.y), ())
+        return [
+            key for key in keys
+            if self._boxes[key][0] <= p.x <= self._boxes[key][2] and self._boxes[key][1] <= p.y <= self._boxes[key][3]
+        ]
+
+    def nearest(self, p: Point, k: int = 1, maxDistance: float = math.inf, keys=None) -> list:
+        """
+            Up to `k` keys sorted by the distance of their box centre to `p`, within `maxDistance`.
+            `keys` restricts the search to those boxes. Rings of cells are visited outwards until
+            no unvisited cell can hold a closer centre.
+        """
+        if keys is not None:
+            found = sorted(
+                ((math.dist(self._center(key), (p.x, p.y)), key) for key in keys if key in self._boxes),
+                key=lambda item: item[0],
+            )
+            return [key for dist, key in found if dist <= maxDistance][:k]
+
+        if not self._centers:
+            return []
+
+        if self._extent is None:
+            cols = [c for c, _ in self._centers]
+            rows = [r for _, r in self._centers]
+            self._extent = (min(cols), min(rows), max(cols), max(rows))
+
+        cx, cy = self._cell(p.x, p.y)
+        c0, r0, c1, r1 = self._extent
+        maxRing = max(abs(cx - c0), abs(cx - c1), abs(cy - r0), abs(cy - r1))
+
+        found = []
+        for ring in range(maxRing + 1):
+            for cell in self._ring(cx, cy, ring):
+                for key in self._centers.get(cell, ()):
+                    found.append((math.dist(self._center(key), (p.x, p.y)), key))
+
+            # centres in the next rings are at least `ring` cells away
+            found.sort(key=lambda item: item[0])
+            bound = min(ring * self.cellSize, maxDistance)
+            if len(found) >= k and found[k - 1][0] <= bound or ring * self.cellSize > maxDistance:
+                break
+
+        return [key for dist, key in found[:k] if dist <= maxDistance]
@@ -1,6 +1,8 @@
 from .point import Point
 
 class Rectangle():
+    __slots__ = ("x", "y", "w", "h", "xx", "yy", "idx", "center", "limits", "valid")
+
     def __init__(self, x, y, w, h, idx=None):
         self.x = x
         self.y = y
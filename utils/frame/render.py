@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+
+from .drawings import Color
+
+
+class OverlayCompositor:
+    """
+        Composites the preview overlays over a frame. The dish mask and the static
+        drawings (stamp) are cached as layers and only rebuilt when their key changes.
+    """
+    def __init__(self, color=Color.CYAN, alpha=0.2):
+        self._color = color
+        self._alpha = alpha
+
+        self._maskKey = None
+        self._maskLayer: np.ndarray = None
+
+        self._stampKey = None
+        self._stamp: np.ndarray = None
+        self._stampCoverage: np.ndarray = None
+        self._edgeIndex = None
+        self._edgeColor: np.ndarray = None
+        self._edgeWeight: np.ndarray = None
+
+        self._output: np.ndarray = None
+
+    @staticmethod
+    def _sameKey(a, b) -> bool:
+        if a is b:
+            return True
+        if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+            return False
+        return a == b
+
+    def updateMask(self, mask: np.ndarray) -> None:
+        """
+            Rebuilds the colored mask layer, `mask` is compared by identity.
+        """
+        if self._sameKey(mask, self._maskKey):
+            return
+
+        self._maskKey = mask
+        if mask is None:
+            self._maskLayer = None
+            return
+
+        self._maskLayer = np.zeros(mask.shape + (3,), dtype=np.uint8)
+        self._maskLayer[mask == 1] = self._color
+
+    def updateStamp(self, key, shape, draw) -> None:
+        """
+            Rebuilds the stamp layer when `key` changes, `draw(frame)` draws the static overlays.
+        """
+        if self._stamp is not None and self._stamp.shape == shape and self._sameKey(key, self._stampKey):
+            return
+
+        self._stampKey = key
+
+        # drawing over a black and a white background recovers the coverage of
+        # each pixel, antialiased edges are the few partially covered ones
+        self._stamp = np.zeros(shape, dtype=np.uint8)
+        reference = np.full(shape, 255, dtype=np.uint8)
+        draw(self._stamp)
+        draw(reference)
+
+        alpha = 255 - (reference.astype(np.int16) - self._stamp).max(axis=2)
+        self._stampCoverage = alpha == 255
+
+        self._edgeIndex = np.nonzero((alpha > 0) & (alpha < 255))
+        self._edgeColor = self._stamp[self._edgeIndex].astype(np.uint16)
+        self._edgeWeight = (255 - alpha[self._edgeIndex]).astype(np.uint16)[:, np.newaxis]
+
+    def compose(self, frame: np.ndarray, drawDynamic=None) -> np.ndarray:
+        """
+            Returns the composited frame, written to a buffer reused between calls.
+            `drawDynamic(frame)` is drawn after the mask and before the stamp.
+        """
+        if self._output is None or self._output.shape != frame.shape:
+            self._output = np.empty_like(frame)
+
+        if self._maskLayer is not None and self._maskLayer.shape == frame.shape:
+            cv2.addWeighted(frame, 1.0 - self._alpha, self._maskLayer, self._alpha, 0, dst=self._output)
+        else:
+            np.copyto(self._output, frame)
+
+        if drawDynamic is not None:
+            drawDynamic(self._output)
+
+        if self._stamp is not None and self._stamp.shape == frame.shape:
+            np.copyto(self._output, self._stamp, where=self._stampCoverage[..., np.newaxis])
+
+            background = self._output[self._edgeIndex].astype(np.uint16)
+            self._output[self._edgeIndex] = np.minimum(background * self._edgeWeight // 255 + self._edgeColor, 255)
+
+        return self._output
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import threading
+import serial
+import serial.tools.list_ports
+
+from typing import Callable, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+
+
+def portKey(port) -> str:
+    """"VID:PID" of a USB port from serial.tools.list_ports, None for ports without USB metadata."""
+    if port.vid is None or port.pid is None:
+        return None
+    return "%04X:%04X" %(port.vid, port.pid)
+
+
+def listPorts() -> list:
+    """
+        Serial ports known to the OS from their device metadata, nothing is opened. USB adapters come
+        first, ports without a USB id (on-board UARTs) after them.
+    """
+    ports = serial.tools.list_ports.comports()
+    return sorted(ports, key=lambda port: (portKey(port) is None, port.device))
+
+
+def probePort(device: str, timeout: float = 0.2) -> Exception:
+    """None if `device` opens, otherwise the error, left to the caller to report."""
+    try:
+        serial.Serial(device, timeout=timeout, write_timeout=timeout).close()
+    except (OSError, ValueError, serial.SerialException) as e:
+        return e
+    return None
+
+
+def probePorts(devices: List[str], timeout: float = 0.2) -> Dict[str, Exception]:
+    """`probePort` of every device, probed concurrently so a slow one costs `timeout` at most once."""
+    if not devices:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(len(devices), 16)) as pool:
+        return dict(zip(devices, pool.map(lambda device: probePort(device, timeout), devices)))
+
+
+class PortDiscovery:
+    """
+        Keeps the list of usable serial ports current from a background thread. The OS listing is
+        polled every `interval` seconds and only devices that appeared are probed. The last port
+        opened for each USB VID:PID is kept in `cachePath` and listed first when that device is back.
+        Devices that failed to open (busy, no permission yet) are probed again after `interval`,
+        doubling up to `maxBackoff` seconds. `onChange(ports, preferred)` is called from the discovery thread.
+    """
+    def __init__(
+        self,
+        cachePath: str = None,
+        onChange: Callable[[List[str], str], None] = None,
+        interval: float = 1.0,
+        probeTimeout: float = 0.2,
+        maxBackoff: float = 30.0,
+    ):
+        self.cachePath = cachePath
+        self.onChange = onChange
+        self.interval = interval
+        self.probeTimeout = probeTimeout
+        self.maxBackoff = maxBackoff
+
+        self._lock = threading.Lock()
+        self._known: Dict[str, str] = {}  # device -> VID:PID of the last listing
+        self._usable: Dict[str, str] = {}  # device -> VID:PID, probed successfully
+        self._failed: Dict[str, tuple] = {}  # device -> (time of the next probe, backoff)
+        self._lastGood: Dict[str, str] = self._loadCache()
+
+        self._stopEvent = threading.Event()
+        self._thread: threading.Thread = None
+
+    def _loadCache(self) -> Dict[str, str]:
+        if self.cachePath is None or not os.path.exists(self.cachePath):
+            return {}
+        try:
+            with open(self.cachePath) as f:
+                return dict(json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            print(e)
+            return {}
+
+    def _saveCache(self) -> None:
+        if self.cachePath is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cachePath), exist_ok=True)
+            with open(self.cachePath, "w") as f:
+                json.dump(self._lastGood, f, indent=2)
+        except OSError as e:
+            print(e)
+
+    @property
+    def ports(self) -> List[str]:
+        """Usable devices, remembered ones first."""
+        with self._lock:
+            preferred = set(self._lastGood.values())
+            return sorted(self._usable, key=lambda device: device not in preferred)
+
+    @property
+    def preferred(self) -> str:
+        """The usable device last opened for its VID:PID, None if none of them is plugged in."""
+        with self._lock:
+            for device, key in self._usable.items():
+                if key is not None and self._lastGood.get(key) == device:
+                    return device
+        return None
+
+    def remember(self, device: str) -> None:
+        """Records `device` as the good port of its VID:PID."""
+        with self._lock:
+            key = self._known.get(device)
+            if key is None or self._lastGood.get(key) == device:
+                return
+            self._lastGood[key] = device
+            self._saveCache()
+
+    def refresh(self) -> bool:
+        """Lists the ports, probes the new ones and the failed ones due for a retry. Returns whether the usable set changed."""
+        listed = {port.device: portKey(port) for port in listPorts()}
+        now = time.monotonic()
+
+        with self._lock:
+            new = [
+                device for device in listed
+                if device not in self._known or device in self._failed and self._failed[device][0] <= now
+            ]
+            # the remembered device of each VID:PID is probed first
+            preferred = set(self._lastGood.values())
+            new.sort(key=lambda device: device not in preferred)
+
+        errors = probePorts(new, self.probeTimeout)
+        usable = {device for device, error in errors.items() if error is None}
+
+        with self._lock:
+            before = set(self._usable)
+            for device in new:
+                if device in usable:
+                    self._failed.pop(device, None)
+                elif device in self._failed:
+                    backoff = min(self._failed[device][1] * 2, self.maxBackoff)
+                    self._failed[device] = (now + backoff, backoff)
+                else:
+                    # reported once, retries stay quiet until the device opens or is unplugged
+                    print("Cannot open %s: %s" %(device, errors[device]))
+                    self._failed[device] = (now + self.interval, self.interval)
+            # unplugged devices start over when they come back
+            self._failed = {device: retry for device, retry in self._failed.items() if device in listed}
+
+            self._known = listed
+            self._usable = {
+                device: key for device, key in listed.items()
+                if device in usable or device in self._usable and device not in self._failed
+            }
+            return set(self._usable) != before
+
+    def _discoveryMain(self):
+        while not self._stopEvent.is_set():
+            if self.refresh() and self.onChange is not None:
+                self.onChange(self.ports, self.preferred)
+            self._stopEvent.wait(self.interval)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._discoveryMain, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,93 @@
+import time
+import numpy as np
+
+from argparse import Namespace
+
+
+def routeLength(points: np.ndarray, start=(0, 0)) -> float:
+    """Length of the path from `start` through the (N, 2) `points` in order."""
+    path = np.vstack((np.reshape(start, (1, 2)), np.reshape(points, (-1, 2))))
+    return float(np.hypot(*np.diff(path, axis=0).T).sum())
+
+
+def nearestNeighbour(points: np.ndarray, start=(0, 0), deadline: float = None) -> np.ndarray:
+    """
+        Visiting order that always moves to the closest unvisited point. Past `deadline`
+        (a time.perf_counter value) the points left are appended in their original order.
+    """
+    order = np.empty(len(points), dtype=np.int64)
+    remaining = np.arange(len(points))
+    x, y = points[:, 0].astype(np.float64), points[:, 1].astype(np.float64)
+    cx, cy = start
+
+    for k in range(len(points)):
+        if deadline is not None and time.perf_counter() > deadline:
+            order[k:] = np.sort(remaining)
+            break
+
+        i = np.argmin((x - cx) ** 2 + (y - cy) ** 2)
+        order[k] = remaining[i]
+        cx, cy = x[i], y[i]
+
+        # the visited point is swapped with the last one and dropped
+        last = len(remaining) - 1
+        remaining[i], x[i], y[i] = remaining[last], x[last], y[last]
+        remaining, x, y = remaining[:last], x[:last], y[:last]
+
+    return order
+
+
+def twoOpt(points: np.ndarray, order: np.ndarray, start=(0, 0), deadline: float = None) -> np.ndarray:
+    """
+        Improves an open path from `start` by reversing segments while that shortens it. For every
+        segment start the gain of all segment ends is computed at once and the best one is applied.
+        Stops when no reversal helps or past `deadline`.
+    """
+    order = order.copy()
+    path = np.vstack((np.reshape(start, (1, 2)), points[order])).astype(np.float64)
+    n = len(path)
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            if deadline is not None and time.perf_counter() > deadline:
+                return order
+
+            a, b = path[i - 1], path[i]
+            ends, after = path[i + 1:], path[i + 2:]
+
+            # reversing path[i:j + 1] swaps the edges (a, b), (c, d) for (a, c), (b, d),
+            # the last point has no edge after it
+            gain = np.hypot(*(a - b)) - np.hypot(*(ends - a).T)
+            gain[:-1] += np.hypot(*(after - ends[:-1]).T) - np.hypot(*(after - b).T)
+
+            j = np.argmax(gain)
+            if gain[j] > 1e-9:
+                j += i + 1
+                path[i:j + 1] = path[i:j + 1][::-1]
+                order[i - 1:j] = order[i - 1:j][::-1]
+                improved = True
+
+    return order
+
+
+def planRoute(points: np.ndarray, start=(0, 0), timeBudget: float = 0.05) -> Namespace:
+    """
+        Visiting order of `points` from the tool position `start`: nearest neighbour refined by 2-opt
+        within `timeBudget` seconds. Returns the order with the travel length before and after.
+    """
+    startTime = time.perf_counter()
+    points = np.reshape(points, (-1, 2))
+    deadline = startTime + timeBudget
+
+    order = np.arange(len(points))
+    if len(points) > 1:
+        order = twoOpt(points, nearestNeighbour(points, start, deadline), start, deadline)
+
+    return Namespace(
+        order=order,
+        before=routeLength(points, start),
+        after=routeLength(points[order], start),
+        elapsed=time.perf_counter() - startTime,
+    )
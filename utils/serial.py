@@ -1,113 +1,506 @@
-import sys
 import serial
-import glob
+import time
 import threading
+import queue
 import re
+import struct
+import binascii
+import itertools
+import numpy as np
 
 from typing import List, Tuple
+from argparse import Namespace
 
 import serial.serialutil
-from .entities import Colony
+from .entities import Colony, ColonyTable
+from .ports import listPorts, probePorts
+
+
+# Binary frames: sync, version, type, sequence (u8), payload length (u8), payload, then the
+# CRC-16/CCITT (u16, little endian) of everything between the sync byte and the CRC.
+FRAME_SYNC = 0xA5
+# version 2 widened the point indices to u32, plates of more than 65535 points no longer wrap
+FRAME_VERSION = 2
+FRAME_HEADER = struct.Struct("<BBBBB")
+FRAME_CRC = struct.Struct("<H")
+MAX_PAYLOAD = 64
+
+# coordinates travel as int16 hundredths of a millimetre, +-327.67 mm
+FIXED_POINT_SCALE = 100
+FIXED_POINT = struct.Struct("<hh")
+
+FRAME_TYPES = {
+    # host to device
+    "POINT": 0x01,      # x, y
+    "BULK": 0x02,       # empty, the device answers with its capacity (u32)
+    "CHUNK": 0x03,      # start (u32), then x, y per point
+    "HELLO": 0x04,      # version (u8), answered by the device with its own
+    # device to host
+    "ENTER": 0x10,      # empty
+    "CORRECTION": 0x11, # x, y
+    "ACK": 0x12,        # start (u32), free slots (u32)
+    "NAK": 0x13,        # start (u32), expected start (u32)
+    "NEXT": 0x14,       # index (u32)
+}
+FRAME_KINDS = {value: key for key, value in FRAME_TYPES.items()}
+
+
+def crc16(data: bytes) -> int:
+    """CRC-16/CCITT-FALSE, polynomial 0x1021 with 0xFFFF as initial value."""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encodeFrame(kind: str, seq: int, payload: bytes = b"") -> bytes:
+    body = FRAME_HEADER.pack(FRAME_SYNC, FRAME_VERSION, FRAME_TYPES[kind], seq & 0xFF, len(payload)) + payload
+    return body + FRAME_CRC.pack(crc16(body[1:]))
+
+
+def encodePoints(points) -> bytes:
+    """(N, 2) offsets in mm as consecutive fixed-point x, y pairs."""
+    fixed = np.round(np.asarray(points, dtype=np.float64).reshape(-1, 2) * FIXED_POINT_SCALE)
+    return np.clip(fixed, -32768, 32767).astype("<i2").tobytes()
+
+
+def decodeMessage(kind: str, payload: bytes):
+    """Values of a frame payload, coordinates back in mm."""
+    if kind in ("POINT", "CORRECTION"):
+        return tuple(v / FIXED_POINT_SCALE for v in FIXED_POINT.unpack(payload))
+    if kind in ("ACK", "NAK") and len(payload) == 8:
+        return struct.unpack("<II", payload)
+    if kind in ("NEXT", "BULK") and len(payload) == 4:
+        return struct.unpack("<I", payload)
+    if kind == "HELLO":
+        return tuple(payload[:1])
+    return ()
+
+
+class FrameParser:
+    """
+        Splits the bytes read from the device into binary frames and text lines, the firmware prints
+        text until it is switched to frames. Returns (kind, seq, payload) for frames and (None, None, line)
+        for lines. Frames with a bad CRC are counted in `errors` and skipped one byte at a time.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self.errors = 0
+
+    def reset(self):
+        self._buffer.clear()
+
+    def feed(self, data: bytes) -> list:
+        self._buffer += data
+        messages = []
+        while self._buffer:
+            if self._buffer[0] != FRAME_SYNC:
+                end = self._buffer.find(b"\n")
+                sync = self._buffer.find(bytes([FRAME_SYNC]))
+                if end < 0 or 0 <= sync < end:
+                    if sync < 0:
+                        break
+                    # text interrupted by a frame is dropped
+                    del self._buffer[:sync]
+                    continue
+                messages.append((None, None, self._buffer[:end + 1].decode("ascii", errors="replace")))
+                del self._buffer[:end + 1]
+                continue
+
+            if len(self._buffer) < FRAME_HEADER.size:
+                break
+            _, version, kind, seq, length = FRAME_HEADER.unpack_from(self._buffer)
+            size = FRAME_HEADER.size + length + FRAME_CRC.size
+            if version != FRAME_VERSION or length > MAX_PAYLOAD or kind not in FRAME_KINDS:
+                self.errors += 1
+                del self._buffer[:1]
+                continue
+            if len(self._buffer) < size:
+                break
+
+            frame = bytes(self._buffer[:size])
+            if FRAME_CRC.unpack_from(frame, size - FRAME_CRC.size)[0] != crc16(frame[1:size - FRAME_CRC.size]):
+                self.errors += 1
+                del self._buffer[:1]
+                continue
+
+            messages.append((FRAME_KINDS[kind], seq, frame[FRAME_HEADER.size:size - FRAME_CRC.size]))
+            del self._buffer[:size]
+
+        return messages
+
 
 class SerialWrapper:
     closeEvent = threading.Event()
     updateFinishedEvent = threading.Event()
     dataLock = threading.Lock()
 
-    def __init__(self):
+    def __init__(self, bulk=False, binary=False):
+        # per instance, a closed wrapper does not stop the next one
+        self.closeEvent = threading.Event()
         self.ser = None
         self.data_buffer:List[str] = []
         self.correction_buffer:List[Tuple[float, float]] = []
         self._current_idx = 0
-        self._adjust_point_pattern = re.compile(r"P = \([0-9]+\.[0-9]+, [0-9]+\.[0-9]+\)\n")
+        self._points: np.ndarray = np.zeros((0, 2))
+        # last point sent to the positioner, in mm from the dish centre
+        self.toolPosition: Tuple[float, float] = (0.0, 0.0)
+        # reads return after `readTimeout` seconds without data, bounding the shutdown time
+        self.readTimeout: float = 0.05
+        # a write to a stalled device gives up after `writeTimeout`, bounding the shutdown as well
+        self.writeTimeout: float = 0.05
+        self._wake = threading.Event()
+        self._outbox: queue.Queue = queue.Queue()
+        self._adjust_point_pattern = re.compile(r"P = \((-?[0-9]+\.[0-9]+), (-?[0-9]+\.[0-9]+)\)\n")
+
+        # bulk mode uploads the points up front in checksummed chunks, the device then steps
+        # through them on its own. Without an answer to the handshake the line protocol is used.
+        self.bulk: bool = bulk
+        self.ackTimeout: float = 0.5
+        self.maxRetries: int = 3
+        self.maxChunkLine: int = 96
+        self.maxChunkPoints: int = 8
+        self._upload: Namespace = None
+
+        # binary frames are negotiated with HELLO when a port opens, without an answer the text protocol is kept
+        self.binary: bool = binary
+        self._framed: bool = False
+        self._helloDeadline: float = None
+        self._txSeq = itertools.count()
+        self._rxSeq: int = None
+        self.framesLost: int = 0
+        self._parser = FrameParser()
+
+        # logs every line, frame and write, off by default as it runs once per message
+        self.verbose: bool = False
 
     def open_serial(self, device):
         print("Opening Serial")
         try:
-            self.ser = serial.Serial(device, 115200, write_timeout = 1)
+            ser = serial.Serial(device, 115200, timeout=self.readTimeout, write_timeout=self.writeTimeout)
         except Exception as e:
             print(e)
+            return False
+
+        previous, self.ser = self.ser, ser
+        if previous is not None:
+            previous.close()
+        self._wake.set()
+        return True
+
+    def close_serial(self):
+        previous, self.ser = self.ser, None
+        if previous is not None:
+            previous.close()
+        self._wake.set()
 
     def get_available_ports(self):
         """ Lists serial port names
 
-            :raises EnvironmentError:
-                On unsupported or unknown platforms
             :returns:
-                A list of the serial ports available on the system
+                A list of the serial ports available on the system, from the OS device listing,
+                probed concurrently
         """
-        if sys.platform.startswith('win'):
-            ports = ['COM%s' % (i + 1) for i in range(256)]
-        elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-            # this excludes your current terminal "/dev/tty"
-            ports = glob.glob('/dev/tty[A-Za-z]*')
-        elif sys.platform.startswith('darwin'):
-            ports = glob.glob('/dev/tty.*')
-        else:
-            raise EnvironmentError('Unsupported platform')
-
-        result = []
-        for port in ports:
-            try:
-                s = serial.Serial(port)
-                s.close()
-                result.append(port)
-            except (OSError, serial.SerialException) as e:
-                print(e)
-        return result
+        errors = probePorts([port.device for port in listPorts()])
+        return [device for device, error in errors.items() if error is None]
     
     def get_serial_message(self, colonies: List[Colony]):
+        if isinstance(colonies, ColonyTable):
+            return colonies.encode()
+
         return ["(%.4f,%.4f)"%(i.getOffset().x, i.getOffset().y) for i in colonies]
     
     def on_close(self):
         self.closeEvent.set()
+        self._wake.set()
 
     def setPoints(self, colonies: List[Colony]):
         data = self.get_serial_message(colonies)
         with SerialWrapper.dataLock:
             self.data_buffer = data
+            self._points = colonies.offsets if isinstance(colonies, ColonyTable) else \
+                np.array([tuple(c.getOffset()) for c in colonies], dtype=np.float64).reshape(-1, 2)
             self._current_idx = 0
+            self._upload = None
+            if self.bulk and self.ser is not None and self.ser.is_open:
+                self._startUpload()
+        self._checkFinished()
+
+    def _startUpload(self):
+        """Resets the device queue, the chunks are sent once it answers with its capacity. Holds dataLock."""
+        self._upload = Namespace(active=False, sent=0, free=0, capacity=0, inflight=None, retries=0, deadline=time.time() + self.ackTimeout)
+        self._outbox.put(encodeFrame("BULK", next(self._txSeq)) if self._framed else b"BULK\n")
+
+    def _sendChunk(self):
+        """Sends the next chunk when the device has room and no chunk waits for its ACK. Holds dataLock."""
+        upload = self._upload
+        if upload is None or not upload.active or upload.inflight is not None:
+            return
+
+        start = upload.sent
+        # the queue is topped up a full chunk at a time, a queue smaller than a chunk is filled whole
+        if upload.free <= 0 or upload.free < min(self.maxChunkPoints, len(self.data_buffer) - start, upload.capacity):
+            return
+
+        if self._framed:
+            count = min(upload.free, self.maxChunkPoints, len(self.data_buffer) - start)
+            if count <= 0:
+                return
+            try:
+                frame = encodeFrame("CHUNK", next(self._txSeq), struct.pack("<I", start) + encodePoints(self._points[start:start + count]))
+            except struct.error as e:
+                self._fallback("chunk %d cannot be encoded: %s" %(start, e))
+                return
+        else:
+            body = "PC%d:" %(start)
+            count = 0
+            while start + count < len(self.data_buffer) and count < min(upload.free, self.maxChunkPoints):
+                point = self.data_buffer[start + count].strip("()")
+                if len(body) + len(point) + 4 > self.maxChunkLine:
+                    break
+                body += (";" if count else "") + point
+                count += 1
+
+            if count == 0:
+                return
+
+            checksum = 0
+            for c in body.encode():
+                checksum ^= c
+            frame = ("%s*%02X\n" %(body, checksum)).encode()
+
+        upload.inflight = Namespace(start=start, count=count, frame=frame)
+        upload.deadline = time.time() + self.ackTimeout
+        self._outbox.put(frame)
+
+    def _fallback(self, reason):
+        """Stops the upload, the points not on the device are sent over the line protocol. Holds dataLock."""
+        print("Bulk upload stopped (%s), using the line protocol." %(reason))
+        self._current_idx = self._upload.sent
+        self._upload = None
+
+    def _checkUpload(self):
+        if self._helloDeadline is not None and time.time() > self._helloDeadline:
+            print("No answer to HELLO, using the text protocol.")
+            self._helloDeadline = None
+
+        with SerialWrapper.dataLock:
+            upload = self._upload
+            if upload is None or time.time() < upload.deadline:
+                return
+
+            if not upload.active:
+                self._fallback("no answer to BULK")
+            elif upload.inflight is not None:
+                upload.retries += 1
+                if upload.retries > self.maxRetries:
+                    self._fallback("chunk %d not acknowledged" %(upload.inflight.start))
+                    return
+                upload.deadline = time.time() + self.ackTimeout
+                self._outbox.put(upload.inflight.frame)
+
+    def _handleBulk(self, kind: str, values) -> None:
+        """Handles the bulk mode replies."""
+        with SerialWrapper.dataLock:
+            upload = self._upload
+            if kind == "NEXT":
+                # the device moved to a point of its queue
+                if values[0] < len(self.data_buffer):
+                    self._current_idx = values[0] + 1
+                    self.toolPosition = tuple(self._points[values[0]].tolist())
+                if upload is not None:
+                    upload.free += 1
+                    self._sendChunk()
+                return
+
+            if upload is None:
+                return
+
+            if kind == "BULK":
+                upload.active, upload.free, upload.capacity = True, values[0], values[0]
+            elif upload.inflight is not None and values[0] == upload.inflight.start:
+                if kind == "ACK":
+                    upload.sent += upload.inflight.count
+                    upload.free = values[1]
+                    upload.inflight, upload.retries = None, 0
+                else:
+                    upload.retries += 1
+                    if upload.retries > self.maxRetries:
+                        self._fallback("chunk %d rejected" %(values[0]))
+                        return
+                    upload.deadline = time.time() + self.ackTimeout
+                    self._outbox.put(upload.inflight.frame)
+                    return
+            self._sendChunk()
+
+    def _checkFinished(self):
+        if len(self.correction_buffer) == len(self.data_buffer):
+            self.updateFinishedEvent.set()
 
     def sendData(self, data):
-        if self.ser is not None and data is not None:
-            data = "PT" + data + "\n"
-            print("Data sent:", data)
+        """Queues a point for the writer thread, the caller never blocks on the port."""
+        if data is not None:
+            self._outbox.put(("PT" + data + "\n").encode())
+
+    def _sendPoint(self, idx):
+        if self._framed:
+            self._outbox.put(encodeFrame("POINT", next(self._txSeq), encodePoints(self._points[idx])))
+        else:
+            self.sendData(self.data_buffer[idx])
+
+    def _writerMain(self):
+        while True:
+            data = self._outbox.get()
+            # writes still queued at shutdown are dropped
+            if data is None or self.closeEvent.is_set():
+                return
+
+            ser = self.ser
+            if ser is None or not ser.is_open:
+                continue
+
+            if self.verbose:
+                print("Data sent:", data.hex(" ") if data[0] == FRAME_SYNC else data.decode())
             try:
-                self.ser.write(data.encode())
+                ser.write(data)
             except serial.serialutil.SerialTimeoutException:
                 print("Serial Timeout")
+            except (serial.SerialException, OSError) as e:
+                print(e)
 
-    def serialMain(self):
-        while True:
-            if self.closeEvent.isSet():
-                return
+    def _parseLine(self, control_byte: str):
+        """Text protocol line as (kind, values), None for anything else the firmware prints."""
+        if control_byte == 'ENTER\n':
+            return "ENTER", ()
+
+        match = self._adjust_point_pattern.match(control_byte)
+        if match:
+            return "CORRECTION", (float(match.group(1)), float(match.group(2)))
+
+        fields = control_byte.split()
+        if len(fields) >= 2 and fields[0] in ("BULK", "ACK", "NAK", "NEXT") and all(f.isdigit() for f in fields[1:]):
+            return fields[0], tuple(int(f) for f in fields[1:])
+
+        return None
+
+    def _handleFrame(self, kind: str, seq: int, payload: bytes):
+        if self._rxSeq is not None and seq != self._rxSeq:
+            lost = (seq - self._rxSeq) & 0xFF
+            self.framesLost += lost
+            print("%d frame(s) lost before %s %d." %(lost, kind, seq))
+        self._rxSeq = (seq + 1) & 0xFF
 
-            if len(self.correction_buffer) == len(self.data_buffer):
-                self.updateFinishedEvent.set()
+        values = decodeMessage(kind, payload)
+        if self.verbose:
+            print(kind, values)
+        if kind == "HELLO":
+            self._framed = True
+            self._helloDeadline = None
+            print("Binary frames, device version %d." %(values[0] if values else 0))
+            return
+
+        self._handleMessage(kind, values)
+
+    def _handleMessage(self, kind: str, values):
+        if kind == "ENTER":
+            # get next msg, during an upload the device queue ran dry and the next point not on it is sent
+            with SerialWrapper.dataLock:
+                upload = self._upload
+                if upload is not None and upload.inflight is None:
+                    self._current_idx = upload.sent
+                idx = None
+                if self._current_idx < len(self.data_buffer) and (upload is None or upload.inflight is None):
+                    idx = self._current_idx
+                    self.toolPosition = tuple(self._points[idx].tolist())
+                    self._current_idx += 1
+                    if upload is not None:
+                        upload.sent = self._current_idx
+                elif upload is not None and upload.inflight is not None:
+                    # the device keeps the press and moves once the chunk is queued
+                    print("Chunk %d is still being uploaded." %(upload.inflight.start))
+            
+            if idx is not None:
+                self._sendPoint(idx)
+
+        elif kind == "CORRECTION":
+            print("Adjusting point... ", end="")
+
+            if self._current_idx - 1 < 0:
+                print("point adjustment error: %d - 1 < 0" %(self._current_idx))
+
+            with SerialWrapper.dataLock:
+                self.correction_buffer.append(values)
             
-            if self.ser is not None and self.ser.is_open:
-                control_byte = self.ser.readline().decode("ascii")
-                print(control_byte)
-
-                if control_byte == 'ENTER\n':
-                    # get next msg
-                    with SerialWrapper.dataLock:
-                        if self._current_idx < len(self.data_buffer):
-                            serial_data = self.data_buffer[self._current_idx]
-                            self._current_idx += 1
-                        else:
-                            serial_data = None
-                    
-                    self.sendData(serial_data)
-
-                elif self._adjust_point_pattern.match(control_byte):
-                    print("Adjusting point... ", end="")
-
-                    if self._current_idx - 1 < 0:
-                        print("point adjustment error: %d - 1 < 0" %(self._current_idx))
-
-                    new_point = eval(control_byte[4:-1])
-                    with SerialWrapper.dataLock:
-                        self.correction_buffer.append(new_point)
-                    
-                    print("point fixed.")
+            print("point fixed.")
+
+        elif kind in ("BULK", "ACK", "NAK", "NEXT") and values:
+            self._handleBulk(kind, values)
+
+    def _onPortOpened(self):
+        self._parser.reset()
+        self._framed = False
+        self._rxSeq = None
+        if self.binary:
+            self._outbox.put(encodeFrame("HELLO", next(self._txSeq), bytes([FRAME_VERSION])))
+            self._helloDeadline = time.time() + self.ackTimeout
+
+    def serialMain(self):
+        """
+            Reads the device lines and frames until `closeEvent` is set. Reads block for at most `readTimeout`,
+            with no port open the thread sleeps until one is opened, writes go through a writer thread.
+        """
+        writer = threading.Thread(target=self._writerMain, daemon=True)
+        writer.start()
+
+        port = None
+        while not self.closeEvent.is_set():
+            try:
+                self._checkFinished()
+                self._checkUpload()
+            except (struct.error, ValueError) as e:
+                # a message that cannot be encoded is dropped, the link keeps running
+                print(e)
+
+            ser = self.ser
+            if ser is None or not ser.is_open:
+                self._wake.wait(self.readTimeout)
+                self._wake.clear()
+                continue
+
+            if ser is not port:
+                port = ser
+                self._onPortOpened()
+
+            try:
+                chunk = ser.read(ser.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError) as e:
+                # the port was closed or replaced under the read
+                if ser is self.ser:
+                    print(e)
+                    self.closeEvent.wait(self.readTimeout)
+                continue
+
+            if not chunk:
+                continue
+
+            for kind, seq, payload in self._parser.feed(chunk):
+                try:
+                    if kind is not None:
+                        self._handleFrame(kind, seq, payload)
+                        continue
+
+                    if self.verbose:
+                        print(payload)
+                    message = self._parseLine(payload)
+                    if message is not None:
+                        self._handleMessage(*message)
+                except (struct.error, ValueError) as e:
+                    print(e)
+
+        self._outbox.put(None)
+        ser = self.ser
+        if ser is not None and ser.is_open:
+            try:
+                ser.cancel_write()
+            except (AttributeError, OSError, serial.SerialException):
+                pass
+        writer.join(self.writeTimeout + self.readTimeout)
+        if ser is not None:
+            ser.close()
@@ -0,0 +1,211 @@
+"""
+    Positioner simulator on a pseudo-terminal, speaks the protocol of arduino-button/src/main.cpp
+    (ENTER / PT lines, bulk upload and binary frames) so SerialWrapper can run without the board.
+    POSIX only, the host opens `PositionerSimulator.port` as it would the Arduino.
+"""
+import os
+import pty
+import time
+import tty
+import struct
+import threading
+import selectors
+import numpy as np
+
+from .serial import FrameParser, encodeFrame, encodePoints, decodeMessage, FIXED_POINT_SCALE, FRAME_VERSION
+
+
+class PositionerSimulator:
+    """
+        `baud` delays every transfer by its time on the wire (10 bits per byte). Once `startOperator` is
+        called, the button is pressed `buttonLatency` seconds after each move. After a move a correction
+        is reported with `correctionProbability`, jittered by `correctionNoise` mm.
+    """
+    def __init__(
+        self,
+        baud=115200,
+        buttonLatency=0.0,
+        correctionProbability=0.0,
+        correctionNoise=0.1,
+        bulk=True,
+        binary=True,
+        queueSize=64,
+        seed=0,
+    ):
+        self.baud = baud
+        self.buttonLatency = buttonLatency
+        self.correctionProbability = correctionProbability
+        self.correctionNoise = correctionNoise
+        self.bulk = bulk
+        self.binary = binary
+        self.queueSize = queueSize
+        self._rng = np.random.default_rng(seed)
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._parser = FrameParser()
+        self._writeLock = threading.Lock()
+        self._framed = False
+        self._txSeq = 0
+
+        self._queue = []
+        self._headIndex = 0
+        self._queueLock = threading.Lock()
+        self._pressPending = False
+
+        # (press time, move time, x, y) of every point visited
+        self.moves = []
+        self.corrections = []
+        self._pressTime = None
+        self._moved = threading.Event()
+
+        self._stopEvent = threading.Event()
+        self._threads = [threading.Thread(target=self._readMain, daemon=True)]
+        self._threads[0].start()
+
+    def _wire(self, size):
+        time.sleep(size * 10 / self.baud)
+
+    def _send(self, kind, text, payload=b""):
+        with self._writeLock:
+            if self._framed:
+                data = encodeFrame(kind, self._txSeq, payload)
+                self._txSeq += 1
+            else:
+                data = text.encode()
+
+            self._wire(len(data))
+            os.write(self._master, data)
+
+    def _reply(self, kind, *values):
+        self._send(kind, " ".join([kind] + [str(v) for v in values]) + "\n", struct.pack("<%dI" %(len(values)), *values))
+
+    def _readMain(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._master, selectors.EVENT_READ)
+        while not self._stopEvent.is_set():
+            if not selector.select(0.05):
+                continue
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                return
+
+            self._wire(len(data))
+            for kind, _, payload in self._parser.feed(data):
+                if kind is None:
+                    self._handleLine(payload.rstrip("\r\n"))
+                else:
+                    self._handleFrame(kind, payload)
+
+    def _handleLine(self, line):
+        if line.startswith("BULK") and self.bulk:
+            self._resetQueue()
+        elif line.startswith("PC") and self.bulk:
+            body, _, checksum = line.partition("*")
+            start = int(body[2:body.index(":")])
+            check = 0
+            for c in body.encode():
+                check ^= c
+            if not checksum or check != int(checksum, 16):
+                self._reply("NAK", start, self._headIndex + len(self._queue))
+                return
+            points = [tuple(float(v) for v in point.split(",")) for point in body.split(":")[1].split(";")]
+            self._queuePoints(start, points)
+        elif line.startswith("PT"):
+            self._moveTo(*(float(v) for v in line[3:-1].split(",")))
+
+    def _handleFrame(self, kind, payload):
+        if kind == "HELLO" and self.binary:
+            self._framed = True
+            self._send("HELLO", "", bytes([FRAME_VERSION]))
+        elif kind == "BULK" and self.bulk:
+            self._resetQueue()
+        elif kind == "POINT":
+            self._moveTo(*decodeMessage(kind, payload))
+        elif kind == "CHUNK" and self.bulk:
+            start = struct.unpack_from("<I", payload)[0]
+            points = [(x / FIXED_POINT_SCALE, y / FIXED_POINT_SCALE) for x, y in struct.iter_unpack("<hh", payload[4:])]
+            self._queuePoints(start, points)
+
+    def _resetQueue(self):
+        with self._queueLock:
+            self._queue = []
+            self._headIndex = 0
+            self._pressPending = False
+            self._reply("BULK", self.queueSize)
+
+    def _queuePoints(self, start, points):
+        with self._queueLock:
+            self._queuePointsLocked(start, points)
+
+    def _queuePointsLocked(self, start, points):
+        expected = self._headIndex + len(self._queue)
+        if start < expected:
+            self._reply("ACK", start, self.queueSize - len(self._queue))
+            return
+        if start > expected:
+            if self._queue:
+                self._reply("NAK", start, expected)
+                return
+            self._headIndex = start
+        if len(points) > self.queueSize - len(self._queue):
+            self._reply("NAK", start, expected)
+            return
+
+        self._queue += points
+        self._reply("ACK", start, self.queueSize - len(self._queue))
+
+        # the button was pressed while the queue was empty
+        if self._pressPending:
+            self._nextQueuedPoint()
+
+    def _nextQueuedPoint(self):
+        x, y = self._queue.pop(0)
+        self._moveTo(x, y)
+        self._reply("NEXT", self._headIndex)
+        self._headIndex += 1
+
+    def _moveTo(self, x, y):
+        self._pressPending = False
+        self.moves.append((self._pressTime, time.perf_counter(), x, y))
+        if self._rng.uniform() < self.correctionProbability:
+            cx, cy = np.array([x, y]) + self._rng.normal(0, self.correctionNoise, 2)
+            self.corrections.append((cx, cy))
+            self._send("CORRECTION", "P = (%.4f, %.4f)\n" %(cx, cy), encodePoints((cx, cy)))
+        self._moved.set()
+
+    def press(self):
+        """A button press, moves to the next queued point or asks the host for one."""
+        self._pressTime = time.perf_counter()
+        with self._queueLock:
+            if self._queue:
+                self._nextQueuedPoint()
+                return
+
+            self._pressPending = True
+            self._send("ENTER", "ENTER\n")
+
+    def startOperator(self):
+        """Presses the button after every move until `close`."""
+        thread = threading.Thread(target=self._operatorMain, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _operatorMain(self):
+        while not self._stopEvent.is_set():
+            self._moved.clear()
+            self.press()
+            # an unanswered ENTER (nothing to send yet) is pressed again
+            if self._moved.wait(0.5):
+                self._stopEvent.wait(self.buttonLatency)
+
+    def close(self):
+        self._stopEvent.set()
+        for thread in self._threads:
+            thread.join()
+        os.close(self._master)
+        os.close(self._slave)
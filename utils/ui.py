@@ -1,6 +1,11 @@
+import cv2
+import time
+import threading
+import numpy as np
 import tkinter as tk
 
 from abc import abstractmethod
+from PIL import Image, ImageTk
 
 class Controls:
     def __init__(self, root):
@@ -11,4 +16,119 @@ class Controls:
 
     @abstractmethod
     def placeControls(self) -> None:
-        pass
\ No newline at end of file
+        pass
+
+
+class CanvasImage:
+    """
+    Single persistent image item on a canvas, new frames are pasted into the same PhotoImage.
+    """
+    def __init__(self, canvas: tk.Canvas, x=0, y=0):
+        self.canvas = canvas
+        self.x = x
+        self.y = y
+
+        self._item = None
+        self._photo = None
+        self._rgb = None
+
+    def show(self, frame) -> None:
+        if self._rgb is None or self._rgb.shape != frame.shape:
+            self._rgb = frame.copy()
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        image = Image.fromarray(self._rgb)
+
+        if self._photo is None or (self._photo.width(), self._photo.height()) != image.size:
+            self._photo = ImageTk.PhotoImage(image=image)
+            if self._item is None:
+                self._item = self.canvas.create_image(self.x, self.y, image=self._photo, anchor="nw")
+                self.canvas.tag_lower(self._item)
+            else:
+                self.canvas.itemconfig(self._item, image=self._photo)
+        else:
+            self._photo.paste(image)
+
+
+class UIBridge:
+    """
+    Hand-off between worker threads and the Tk main loop, only the main thread touches Tk.
+    Workers publish frames into a single slot (newer frames replace unseen ones) and read
+    parameter snapshots, the main loop pulls from the slot on an `after()` schedule.
+    """
+    def __init__(self, root, onFrame, fps=60):
+        self.root = root
+        self.onFrame = onFrame
+        self.period = 1 / fps
+
+        self._lock = threading.Lock()
+        self._slot = None
+        self._front = None
+        self._fresh = False
+
+        self._getters = {}
+        self._params = {}
+        self._calls = []
+
+        self.renderTime: float = 0
+        self.meanRenderTime: float = 0
+        self._afterId = None
+
+    def addParam(self, name, getter) -> None:
+        """`getter` is called on the main thread, its value is published to the workers."""
+        self._getters[name] = getter
+        self._params[name] = getter()
+
+    def getParams(self) -> dict:
+        with self._lock:
+            return dict(self._params)
+
+    def call(self, function, *args) -> None:
+        """Runs `function(*args)` on the main thread at the next poll."""
+        with self._lock:
+            self._calls.append((function, args))
+
+    def publishFrame(self, frame) -> None:
+        with self._lock:
+            if self._slot is None or self._slot.shape != frame.shape:
+                self._slot = frame.copy()
+            else:
+                np.copyto(self._slot, frame)
+            self._fresh = True
+
+    def _takeFrame(self):
+        with self._lock:
+            if not self._fresh:
+                return None
+            self._slot, self._front = self._front, self._slot
+            self._fresh = False
+            return self._front
+
+    def _poll(self) -> None:
+        startTime = time.perf_counter()
+
+        params = {name: getter() for name, getter in self._getters.items()}
+        with self._lock:
+            self._params = params
+            calls, self._calls = self._calls, []
+
+        for function, args in calls:
+            function(*args)
+
+        frame = self._takeFrame()
+        if frame is not None:
+            self.onFrame(frame)
+            self.renderTime = time.perf_counter() - startTime
+            self.meanRenderTime = 0.95 * self.meanRenderTime + 0.05 * self.renderTime
+
+        # a slow main loop gets a longer period instead of a growing backlog
+        elapsed = time.perf_counter() - startTime
+        delay = max(self.period - elapsed, elapsed)
+        self._afterId = self.root.after(max(int(delay * 1000), 1), self._poll)
+
+    def start(self) -> None:
+        self._afterId = self.root.after(0, self._poll)
+
+    def stop(self) -> None:
+        if self._afterId is not None:
+            self.root.after_cancel(self._afterId)
+            self._afterId = None
@@ -6,25 +6,29 @@ import tkinter as tk
 import os
 
 from pathlib import Path
-from collections import OrderedDict, deque
+from collections import OrderedDict
 from argparse import Namespace
-from PIL import Image, ImageTk
 
-from typing import List, Deque
+from typing import List
 
 from detection.traditional.watershed import WaterShed
 
 from detection.deep.yolov6 import ONNXModel
 from detection.traditional.cv import CVDetector
 
-from utils.frame.drawings import getBboxes, drawBoxes, Color
-from utils.entities import PetriDish, Colony
+from utils.frame.drawings import filterDetections, validRegion, drawBoxes, Color
+from utils.entities import PetriDish, DishTracker, ColonyTable
 from utils.controllers import PetriDishController, FrameController, YoloController, SerialController
-from utils.frame.geometry import Rectangle, Point, Circle
+from utils.frame.geometry import Rectangle, Point, Circle, BoxArray, SpatialGrid
 from utils.frame import center_crop
-from utils.camera import list_ports
+from utils.frame.buffer import FrameAccumulator, DoubleBuffer
+from utils.frame.render import OverlayCompositor
+from utils.camera import list_ports, CameraStream
 from utils.serial import SerialWrapper
+from utils.ports import PortDiscovery
 from utils.saving import get_timehash, save_xy_center, save_image
+from utils.ui import CanvasImage, UIBridge
+from utils.route import planRoute
 
 import threading
 
@@ -44,6 +48,12 @@ class MainWindow:
         self.running = True
         self.root.title("Bacteria Detection")
         self.resolution: Namespace = Namespace(x=640, y=640)
+        self.bufferDepth: int = 10
+        self.routeBudget: float = 0.05
+        # lists every colony sent to the positioner
+        self.verbose: bool = False
+        # native capture format, so frames arrive close to the crop size
+        self.cameraFormat: Namespace = Namespace(fourcc="MJPG", width=1280, height=720, bufferSize=1)
         self._imageCenter = Circle(self.resolution.x // 2, self.resolution.y // 2, 1)
         # self.detector: ONNXModel = ONNXModel(
         #     model_path="./models/bacteria-filtered-smallbox.onnx", 
@@ -56,19 +66,26 @@ class MainWindow:
         # self.petriEllipse = EllipseController(self.resolution, root=self.root)
         self.petriController: PetriDishController = PetriDishController(root=self.root)
         self.petri: PetriDish = PetriDish(self.petriController.diameter)
+        self.dishTracker: DishTracker = DishTracker(self.petri)
         # self.frameController: FrameController = FrameController(self.resolution.y, self.resolution.x, root=self.root)
         # self.waterShed: WaterShed = WaterShed(self.root)
         self.yoloController: YoloController = YoloController(self.root)
-        self.colonies: List[Colony] = []
+        self.colonies: ColonyTable = ColonyTable.empty()
 
         # Interface gráfica
         # self.petriEllipse.placeControls()
         # self.frameController.placeControls()
         self.petriController.placeControls()
-        self.serial = SerialWrapper()
+        # firmware without bulk upload or binary frames falls back to the text protocol, one point per ENTER
+        self.serial = SerialWrapper(bulk=True, binary=True)
+        # ports are probed in the background, the dropdown is filled once they are known
+        self.portDiscovery = PortDiscovery(
+            cachePath=os.path.join(Path.home(), ".CameraPositioner", "ports.json"),
+            onChange=lambda ports, preferred: self.uiBridge.call(self.on_ports_change, ports, preferred),
+        )
         self.serialController = SerialController(
             root=self.root, 
-            options=self.serial.get_available_ports(), 
+            options=[], 
             on_serial_change=self.on_serial_change,
             name="Serial Port",
         )
@@ -84,11 +101,25 @@ class MainWindow:
         self.canvas.bind("<ButtonPress-3>", self.on_right_button_press)
         self.canvas.bind("<ButtonRelease-3>", self.on_right_button_release)
         self.canvas.pack()
+        self.canvasImage: CanvasImage = CanvasImage(self.canvas)
+        self.renderText = self.canvas.create_text(5, 5, anchor="nw", fill="white", text="")
+        self.compositor: OverlayCompositor = OverlayCompositor()
+
+        # only the main thread touches Tk, workers go through the bridge
+        self.uiBridge: UIBridge = UIBridge(self.root, self.displayFrame)
+        self.uiBridge.addParam("threshold", self.yoloController.threshold.get)
+        self.uiBridge.addParam("diameter", lambda: self.petriController.diameter)
 
         self.removedRect = None
         self.removedAreas: List[Rectangle] = []
+        # hit-testing of clicks against removed areas and detections
+        self.areaIndex: SpatialGrid = SpatialGrid()
+        self.detectionIndex: SpatialGrid = SpatialGrid()
+        self._detectionIndexKey = None
         self.newArea = Rectangle(0,0,0,0)
-        self.bboxes = []
+        self.bboxes: BoxArray = BoxArray.empty()
+        self._valid: np.ndarray = None
+        self._validKey = None
 
         camera_options = ["Camera %d" %(i) for i in list_ports()[1]] #etc
         self.cameraController = SerialController(
@@ -105,11 +136,26 @@ class MainWindow:
             background="green"
         )
         self.snapFrame.pack()
+        self.continuousMode = tk.IntVar(value=0)
+        tk.Checkbutton(
+            root,
+            text="Detecção contínua",
+            variable=self.continuousMode,
+        ).pack()
+        self.uiBridge.addParam("continuous", self.continuousMode.get)
+        self.results: DoubleBuffer = DoubleBuffer(
+            lambda: Namespace(frame=None, raw=None, detections=None, bboxes=BoxArray.empty(), colonies=ColonyTable.empty(), params=None)
+        )
         
         # Feed de vídeo da webcam
-        self.cap = cv2.VideoCapture(int(camera_options[0][-1]))  # Webcam padrão
+        self.camera = CameraStream(
+            int(camera_options[0][-1]),  # Webcam padrão
+            fourcc=self.cameraFormat.fourcc,
+            resolution=(self.cameraFormat.width, self.cameraFormat.height),
+            bufferSize=self.cameraFormat.bufferSize,
+        )
         self.meanFrame:np.ndarray = np.array(0)
-        self.frameBuffer:Deque[np.ndarray] = []
+        self.frameBuffer: FrameAccumulator = FrameAccumulator(self.bufferDepth, lock=MainWindow.frameLock)
         
         # Iniciar a thread para atualizar o feed de vídeo
         self.detection_thread: threading.Thread = threading.Thread(target=self.detectionMain)
@@ -119,6 +165,8 @@ class MainWindow:
         self.detection_thread.start()
         self.serial_thread.start()
         self.video_thread.start()
+        self.uiBridge.start()
+        self.portDiscovery.start()
         
         # Fechar janela com segurança
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
@@ -137,29 +185,57 @@ class MainWindow:
 
     def on_serial_change(self, value):
         print(value)
-        if value != "":
-            self.serial.open_serial(value)
+        if value != "" and self.serial.open_serial(value):
+            self.portDiscovery.remember(value)
+
+    def on_ports_change(self, ports, preferred):
+        self.serialController.setOptions(ports)
+
+        # an unplugged port is closed, its selection was cleared
+        current = self.serial.ser
+        if current is not None and current.port not in ports:
+            self.serial.close_serial()
+            current = None
+
+        # the port last used for the positioner is reopened when nothing usable is open
+        if preferred is not None and current is None:
+            self.serialController.serial_var.set(preferred)
+            self.on_serial_change(preferred)
 
     def on_camera_change(self, value):
-        self.cap.release()
-        self.cap = cv2.VideoCapture(int(value[-1]))  # Webcam padrão
+        self.camera.open(int(value[-1]))  # Webcam padrão
+        self.dishTracker.invalidate()
 
     def on_right_button_press(self, event):
         self.deleteBoxPoint:Point = Point(event.x, event.y)
 
     def on_right_button_release(self, event):
-        idxDelete = 0
-        closestBox = None
-        for i, box in enumerate(self.removedAreas):
-            if box.contains(self.deleteBoxPoint):
-                idxDelete = i
-                if closestBox is None:
-                    closestBox = box
-                else:
-                    if (closestBox.center - self.deleteBoxPoint).abs() > (box.center - self.deleteBoxPoint).abs():
-                        closestBox = box
-        if closestBox != None:
-            self.removedAreas.pop(idxDelete)
+        # the removed area closest to the click, among those containing it
+        nearest = self.areaIndex.nearest(self.deleteBoxPoint, keys=self.areaIndex.contains(self.deleteBoxPoint))
+        if nearest:
+            self.areaIndex.remove(nearest[0])
+            self.removedAreas.remove(nearest[0])
+            return
+
+        # a detection is excluded through an area over its centre, a right click on that area restores it.
+        # The detection thread refines the result on the exclusion change, it owns the result buffers.
+        box = self._detectionNear(self.deleteBoxPoint)
+        if box is not None:
+            area = Rectangle(box.center.x - box.w // 4, box.center.y - box.h // 4, box.w // 2, box.h // 2)
+            self.removedAreas.append(area)
+            self.areaIndex.insert(area, area.x, area.y, area.xx, area.yy)
+
+    def _detectionNear(self, point: Point, maxDistance: float = 20):
+        """The published detection whose centre is closest to `point`, if any within `maxDistance` pixels."""
+        bboxes = self.bboxes
+        if bboxes is not self._detectionIndexKey:
+            self.detectionIndex.clear()
+            for i, (x, y, xx, yy) in enumerate(bboxes.toXYXY().tolist()):
+                self.detectionIndex.insert(i, x, y, xx, yy)
+            self._detectionIndexKey = bboxes
+
+        nearest = self.detectionIndex.nearest(point, maxDistance=maxDistance)
+        return bboxes[nearest[0]] if nearest else None
 
     def on_left_button_press(self, event):
         # save mouse drag start position
@@ -181,8 +257,11 @@ class MainWindow:
         self.canvas.coords(self.removedRect, *self.newArea.get_normal_form())
 
     def on_left_button_release(self, event):
-        self.removedAreas.append(Rectangle(*self.newArea.get_normal_xyhw()))
+        area = Rectangle(*self.newArea.get_normal_xyhw())
+        self.removedAreas.append(area)
+        self.areaIndex.insert(area, area.x, area.y, area.xx, area.yy)
         self.newArea = Rectangle(0,0,0,0)
+        self.canvas.delete(self.removedRect)
     
     def getDebugVariables(self):
         varDict = OrderedDict()
@@ -204,10 +283,40 @@ class MainWindow:
             )
         return frame
     
-    def _arrayToImage(self, data: np.ndarray) -> tk.PhotoImage:
-        data = cv2.cvtColor(data, cv2.COLOR_BGR2RGB)
-        image = Image.fromarray(data)
-        return ImageTk.PhotoImage(image=image)
+    def displayFrame(self, frame: np.ndarray):
+        """Runs on the main thread, called by the UI bridge with the newest frame."""
+        self.canvasImage.show(frame)
+        self.canvas.itemconfig(self.renderText, text="render: %.1f ms" %(self.uiBridge.meanRenderTime * 1000))
+
+    def _drawStaticOverlays(self, frame):
+        if self.petri.isSegmented():
+            self.petri.center.draw(frame, color=Color.RED, thickness=5)
+
+        for area in self.removedAreas:
+            cv2.rectangle(frame, (area.x, area.y), (area.xx, area.yy), (0, 0, 0), -1)
+
+        drawBoxes(self.bboxes, frame)
+        self._imageCenter.draw(frame, Color.BLUE, 5)
+
+    def _drawNewArea(self, frame):
+        if self.newArea.isValid():
+            cv2.rectangle(frame, (self.newArea.x, self.newArea.y), (self.newArea.xx, self.newArea.yy), (0, 0, 0), -1)
+
+    def _renderFrame(self, frame: np.ndarray) -> np.ndarray:
+        """Composes the preview, cached layers are rebuilt only when their inputs change."""
+        self.compositor.updateMask(self.petri._segmentation if self.petri.isSegmented() else None)
+        self.compositor.updateStamp(
+            (
+                self.petri.center,
+                tuple((area.x, area.y, area.xx, area.yy) for area in self.removedAreas),
+                self.bboxes,
+                tuple(self._imageCenter.center),
+            ),
+            frame.shape,
+            self._drawStaticOverlays,
+        )
+
+        return self.compositor.compose(frame, self._drawNewArea)
 
     #class x_center y_center width height
     def save_correction(self, corrections, predictions, frame):
@@ -235,40 +344,25 @@ class MainWindow:
 
     #TODO: implement while running as decorator to remove possibility of editing frame
     def videoMain(self):
+        frameId = 0
         while self.running:
             startTime = time.time()
             if DEBUG:
                 frame = cv2.imread(INPUT_IMAGE)
             else:
-                ret, frame = self.cap.read()
+                frameId, frame = self.camera.read(frameId, timeout=0.1)
+                if frame is None:
+                    if MainWindow.closeEvent.is_set() or not self.running:
+                        MainWindow.processEvent.set()
+                        break
+                    continue
 
             frame = center_crop(frame, (self.resolution.x, self.resolution.y))
-            frameVis = copy.deepcopy(frame)
             
-            with MainWindow.frameLock:
-                if len(self.frameBuffer) == 0:
-                    self.frameBuffer = deque(frame[np.newaxis].repeat(10, 0))
-                else:
-                    self.frameBuffer.popleft()
-                    self.frameBuffer.append(frame)
-
-            if self.petri.isSegmented():
-                frameVis = self.petri.drawMask(frameVis)
-                self.petri.center.draw(frameVis, color=Color.RED, thickness=5)
-
-            if self.newArea.isValid():
-                cv2.rectangle(frameVis, (self.newArea.x, self.newArea.y), (self.newArea.xx, self.newArea.yy), (0, 0, 0), -1)
- 
-            for area in self.removedAreas:
-                cv2.rectangle(frameVis, (area.x, area.y), (area.xx, area.yy), (0, 0, 0), -1)
+            self.frameBuffer.push(frame)
 
-            drawBoxes(self.bboxes, frameVis)
-            self._imageCenter.draw(frameVis, Color.BLUE, 5)
-
-            # Exibe o vídeo em uma janela do OpenCV
-            imageFrame = self._arrayToImage(frameVis)
-            self.canvas.create_image(0, 0, image=imageFrame, anchor="nw")
-            self.canvas.image = imageFrame
+            frameVis = self._renderFrame(frame)
+            self.uiBridge.publishFrame(frameVis)
 
             elapsedTime = time.time() - startTime
             if elapsedTime < 1/60:
@@ -278,55 +372,153 @@ class MainWindow:
                 MainWindow.processEvent.set()
                 break
 
-        self.root.quit()
+    def _exclusionKey(self):
+        return tuple((area.x, area.y, area.xx, area.yy) for area in self.removedAreas)
+
+    def _validRegion(self, shape) -> np.ndarray:
+        """Dish mask minus the removed areas, rebuilt only when either changes."""
+        key = (self.petri._segmentation, self._exclusionKey(), shape[:2])
+        if self._validKey is None or self._validKey[0] is not key[0] or self._validKey[1:] != key[1:]:
+            self._valid = validRegion(shape, self.petri._segmentation, self.removedAreas)
+            self._validKey = key
+
+        return self._valid
+
+    def _detect(self, params: dict) -> float:
+        """Runs detection on the current average and publishes it to `self.results`, returns the elapsed time."""
+        startTime = time.time()
+        result = self.results.back
+        if result.frame is None:
+            result.frame = self.frameBuffer.mean().copy()
+        else:
+            self.frameBuffer.mean(out=result.frame)
+        
+        self.petri.setDishDiameter(params["diameter"])
+        if self.dishTracker.update(result.frame, tuple(self._imageCenter.center)):
+            print("Dish re-segmented (drift: %.3f)." %(self.dishTracker.drift))
+
+        # only the dish bounding box is searched, boxes come back in frame coordinates
+        result.raw = self.detector.predict(
+            result.frame, 
+            roi=self.petri.getBoundingBox(), 
+            mask=self.petri._segmentation,
+        )
+        result.detections = None
+
+        self._postprocess(result, params)
+        self._publish(result)
+
+        return time.time() - startTime
+
+    def _refine(self, params: dict) -> bool:
+        """
+        Re-runs only the stages affected by a parameter change on the latest result: NMS and boxes for the
+        threshold, filtering for the exclusions, colony conversion for the diameter. Returns True if it ran.
+        """
+        front = self.results.front
+        if front.raw is None:
+            return False
+
+        thresholdChanged = front.params["threshold"] != params["threshold"]
+        if not thresholdChanged and front.params["exclusions"] == self._exclusionKey() and front.params["diameter"] == params["diameter"]:
+            return False
+
+        result = self.results.back
+        if result.frame is None or result.frame.shape != front.frame.shape:
+            result.frame = front.frame.copy()
+        else:
+            np.copyto(result.frame, front.frame)
+        result.raw = front.raw
+        result.detections = None if thresholdChanged else front.detections
+
+        self.petri.setDishDiameter(params["diameter"])
+        self._postprocess(result, params)
+        self._publish(result)
+
+        return True
+
+    def _postprocess(self, result: Namespace, params: dict):
+        nms_thr = params["threshold"]
+        # nms_thr = 0
+        if result.detections is None:
+            result.detections = self.detector.postprocess(result.raw, nms_thr)
+
+        result.bboxes = filterDetections(
+            result.detections, 
+            result.frame.shape, 
+            nms_thr, 
+            self._validRegion(result.frame.shape),
+        )
+        
+        result.colonies = ColonyTable(
+            result.bboxes, 
+            self.petri.getCentroid(), 
+            self.petri.getConversionFactor(),
+        )
+
+        result.params = {
+            "threshold": nms_thr,
+            "exclusions": self._exclusionKey(),
+            "diameter": params["diameter"],
+        }
+
+    def _publish(self, result: Namespace):
+        self.results.swap()
+        self.detectionFrame = result.frame
+        self.bboxes = result.bboxes
+        self.colonies = result.colonies
+
+    def _sendResult(self, result: Namespace):
+        # visiting order that keeps the positioner travel short
+        route = planRoute(result.colonies.offsets, self.serial.toolPosition, self.routeBudget)
+        colonies = result.colonies.take(route.order)
+        print("Route: %.1f mm -> %.1f mm planned in %.3f s." %(route.before, route.after, route.elapsed))
+
+        if self.verbose:
+            for idx, offset, center in zip(colonies.idx.tolist(), colonies.offsets.tolist(), colonies.pixelOffsets.tolist()):
+                print(idx, "Point: %s, %s" %tuple(offset), "Point: %s, %s" %tuple(center))
+
+        self.serial.setPoints(colonies)
 
     def detectionMain(self):
         """Realiza segmentação e processamento."""
+        lastFrameCount = -1
         while self.running:
-            MainWindow.processEvent.wait()
+            params = self.uiBridge.getParams()
+            if params["continuous"]:
+                # detections on screen are kept current, a click sends the latest complete result
+                if self.frameBuffer.frameCount != lastFrameCount and not self.frameBuffer.isEmpty():
+                    lastFrameCount = self.frameBuffer.frameCount
+                    self._detect(params)
+                else:
+                    MainWindow.processEvent.wait(0.01)
+
+                if MainWindow.processEvent.is_set() and self.running:
+                    if self.results.version > 0:
+                        self._sendResult(self.results.front)
+                    MainWindow.processEvent.clear()
+            elif not MainWindow.processEvent.wait(0.02):
+                # parameter changes only re-run the post-processing of the last frame,
+                # points are sent on Process Frame only
+                self._refine(params)
+                continue
+
             # Encerra se a tecla 'q' for pressionada
             if MainWindow.closeEvent.is_set() or not self.running:
                 return
 
-            startTime = time.time()
-            with MainWindow.frameLock:
-                self.detectionFrame = np.mean(self.frameBuffer, axis=0).astype(np.uint8)
-            
-            nms_thr = self.yoloController.threshold.get()
-            # nms_thr = 0
-            output = self.detector.inference(self.detectionFrame, nms_thr)
-            
-            self.petri.setDishDiameter(self.petriController.diameter)
-            _ = self.petri.segmentDish(self.detectionFrame)
-            self.petri.findParameters(tuple(self._imageCenter.center))
-
-            _, self.bboxes = getBboxes(
-                output, 
-                (self.resolution.x, self.resolution.y), 
-                nms_thr, 
-                self.removedAreas,
-            )
+            if params["continuous"]:
+                continue
 
-            self.bboxes = [
-                box for box in self.bboxes if self.petri._segmentation[box.center.y][box.center.x]
-            ]
-            
-            self.colonies = [
-                Colony(
-                    r, 
-                    self.petri.getCentroid(), 
-                    self.petri.getConversionFactor()
-                ) 
-                for r in self.bboxes
-            ]
-
-            for c in self.colonies:
-                print(c._detection.idx, c.getOffset(), c._limits.center)
-                
-            self.serial.setPoints(self.colonies)
+            if self.frameBuffer.isEmpty():
+                MainWindow.processEvent.clear()
+                continue
+
+            elapsedTime = self._detect(params)
+            self._sendResult(self.results.front)
 
-            elapsedTime = time.time() - startTime
             print(f"Ellapsed processing time: {elapsedTime}.")
+            print(f"Frame lock held: {self.frameBuffer.meanLockTime() * 1000:.3f} ms mean, {self.frameBuffer.lockStats['max'] * 1000:.3f} ms max.")
 
             # Limpa evento somente quando processamento foi concluído
             MainWindow.processEvent.clear()
@@ -336,7 +528,10 @@ class MainWindow:
         self.running = False
         MainWindow.closeEvent.set()
         MainWindow.processEvent.set()
-        self.serial.closeEvent.set()
+        self.serial.on_close()
+        self.portDiscovery.stop()
+        self.uiBridge.stop()
+        self.root.quit()
 
 # Iniciar o programa
 if __name__ == "__main__":
@@ -347,6 +542,6 @@ if __name__ == "__main__":
     app.video_thread.join()
     app.serial_thread.join()
     app.detection_thread.join()
-    app.cap.release()
+    app.camera.release()
 
     cv2.destroyAllWindows()